@@ -1,38 +1,99 @@
 import os
+import gzip
 import time
 import json
+import glob
+import shutil
 import tweepy
 import random
+import argparse
+import itertools
 import matplotlib_venn
+import multiprocessing
 
 import matplotlib.pyplot as plt
 
 from nltk.corpus import wordnet as wn
+from collections import defaultdict
 
 
 def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--build_index', help='enumerate all the Venn candidates in WordNet and save them to this file')
+    ap.add_argument('--index', help='a Venn candidate index file created with --build_index')
+    ap.add_argument('--produce', action='store_true',
+                    help='only render diagrams into the queue directory, without posting them')
+    ap.add_argument('--queue_dir', help='post pre-rendered diagrams from this directory (or render into it)')
+    ap.add_argument('--max_queued', type=int, default=100, help='the maximal number of diagrams in the queue')
+    ap.add_argument('--processes', type=int, default=4, help='the number of rendering processes')
+    ap.add_argument('--stub', action='store_true', help='post to a local directory instead of Twitter')
+    ap.add_argument('--interval', type=int, default=3600, help='the number of seconds between posts')
+    args = ap.parse_args()
+
+    if args.produce and args.queue_dir is None:
+        ap.error('--produce requires --queue_dir')
+
     wordnet = WordNetHelper()
 
-    # Authenticate to Twitter
-    with open('access_keys.json') as f_in:
-        access_keys = json.load(f_in)
+    if args.build_index is not None:
+        build_venn_index(wordnet, args.build_index)
+        return
+
+    if args.produce:
+        produce_venn_queue(args.queue_dir, max_queued=args.max_queued, processes=args.processes,
+                           index_file=args.index)
+        return
+
+    venn_index = load_venn_index(args.index) if args.index is not None else None
 
-    auth = tweepy.OAuthHandler(access_keys["consumer_key"], access_keys["consumer_secret"])
-    auth.set_access_token(access_keys["access_token"], access_keys["access_token_secret"])
+    if args.stub:
+        api = StubPoster('posted')
+    else:
+        # Authenticate to Twitter
+        with open('access_keys.json') as f_in:
+            access_keys = json.load(f_in)
+
+        auth = tweepy.OAuthHandler(access_keys["consumer_key"], access_keys["consumer_secret"])
+        auth.set_access_token(access_keys["access_token"], access_keys["access_token_secret"])
 
-    # Create API object
-    api = tweepy.API(auth)
+        # Create API object
+        api = tweepy.API(auth)
 
     filename = 'temp.png'
 
     while True:
-        if os.path.exists(filename):
-            os.remove(filename)
+        # Take a pre-rendered diagram from the queue, if there is one
+        queued = dequeue_venn(args.queue_dir) if args.queue_dir is not None else None
+
+        if queued is not None:
+            api.update_with_media(filename=queued)
+            os.remove(queued)
+        else:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+            if venn_index is not None:
+                generate_venn_from_index(venn_index, filename=filename)
+            else:
+                generate_random_venn(wordnet, filename=filename)
+
+            api.update_with_media(filename=filename)
 
-        generate_random_venn(wordnet, filename=filename)
+        time.sleep(args.interval)
 
-        api.update_with_media(filename=filename)
-        time.sleep(3600)
+
+class StubPoster:
+    """
+    A local replacement for the Twitter API (for testing): copies the posted images to a directory
+    """
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+
+    def update_with_media(self, filename):
+        out_file = os.path.join(self.out_dir, '{}_{}'.format(time.time_ns(), os.path.basename(filename)))
+        shutil.copy(filename, out_file)
+        print('Posted {}'.format(out_file))
 
 
 class WordNetHelper:
@@ -40,9 +101,13 @@ class WordNetHelper:
     Retrieves information from WordNet
     """
     def __init__(self):
-        self.all_synsets = list(wn.all_synsets())
+        self.all_synsets = None
 
     def get_random_synset(self):
+        # Only load all the synsets when needed (not when generating from an index)
+        if self.all_synsets is None:
+            self.all_synsets = list(wn.all_synsets())
+
         return random.choice(self.all_synsets)
 
     def get_subclasses(self, synset):
@@ -55,7 +120,23 @@ class WordNetHelper:
         return [l.replace('_', ' ') for l in synset.lemma_names()][0]
 
 
-def draw_venn3(A, B, C, set_labels=['A', 'B', 'C'], filename=None):
+def get_regions(sets):
+    """
+    Get the members of each region of the Venn diagram of the given sets, in a single pass over the members.
+    The regions are ordered as in matplotlib_venn: the region of members that belong to the sets
+    in the binary mask i (A = 1, B = 2, C = 4) is in index i - 1, i.e. for 3 sets:
+    Abc, aBc, ABc, abC, AbC, aBC, ABC
+    """
+    regions = [set() for _ in range(2 ** len(sets) - 1)]
+
+    for member in set.union(*sets):
+        mask = sum(2 ** i for i, s in enumerate(sets) if member in s)
+        regions[mask - 1].add(member)
+
+    return regions
+
+
+def draw_venn3(A, B, C, set_labels=['A', 'B', 'C'], filename=None, regions=None):
     """
     Draw a Venn diagram for sets A, B, and C
     """
@@ -65,13 +146,7 @@ def draw_venn3(A, B, C, set_labels=['A', 'B', 'C'], filename=None):
     _ = matplotlib_venn.venn3_circles(sets, linestyle='solid', linewidth=1)
 
     # Abc, aBc, ABc, abC, AbC, aBC, ABC
-    members = [A.difference(B.union(C)),
-               B.difference(A.union(C)),
-               A.intersection(B).difference(C),
-               C.difference(B.union(A)),
-               A.intersection(C).difference(B),
-               B.intersection(C).difference(A),
-               A.intersection(B).intersection(C)]
+    members = regions if regions is not None else get_regions(sets)
 
     for v, curr_members in zip(diagram.subset_labels, members):
         if v is not None:
@@ -83,7 +158,7 @@ def draw_venn3(A, B, C, set_labels=['A', 'B', 'C'], filename=None):
         plt.show()
         
         
-def draw_venn2(A, B, set_labels=['A', 'B'], filename=None):
+def draw_venn2(A, B, set_labels=['A', 'B'], filename=None, regions=None):
     """
     Draw a Venn diagram for sets A and B
     """
@@ -93,9 +168,7 @@ def draw_venn2(A, B, set_labels=['A', 'B'], filename=None):
     _ = matplotlib_venn.venn2_circles(sets, linestyle='solid', linewidth=1)
 
     # A, B, AB
-    members = [A.difference(B),
-               B.difference(A),
-               A.intersection(B)]
+    members = regions if regions is not None else get_regions(sets)
 
     for v, curr_members in zip(diagram.subset_labels, members):
         if v is not None:
@@ -122,16 +195,12 @@ def generate_random_venn2(intersections, sets):
 
     set_labels = relevant_sets 
 
-    # Randomly select members 
-    A, B = [set(sets[name]) for name in relevant_sets]
-    all_members = [A.difference(B),
-                   B.difference(A),
-                   A.intersection(B)]
-
-    all_members = [random.sample(list(members), 3) if len(members) > 3 else members for members in all_members]
-    all_members = set.union(*[set(s) for s in all_members])
+    # Randomly select members (the regions of the selected members are the selected members of each region)
+    regions = get_regions([set(sets[name]) for name in relevant_sets])
+    regions = [set(random.sample(list(members), 3)) if len(members) > 3 else members for members in regions]
+    all_members = set.union(*regions)
     sets = [set(sets[name]).intersection(all_members) for name in relevant_sets] 
-    return sets, set_labels
+    return sets, set_labels, regions
 
 
 def generate_random_venn3(intersections, sets):
@@ -149,66 +218,224 @@ def generate_random_venn3(intersections, sets):
 
     set_labels = relevant_sets 
 
-    # Randomly select members 
-    A, B, C = [set(sets[name]) for name in relevant_sets]
-    all_members = [A.difference(B.union(C)),
-                   B.difference(A.union(C)),
-                   A.intersection(B).difference(C),
-                   C.difference(B.union(A)),
-                   A.intersection(C).difference(B),
-                   B.intersection(C).difference(A),
-                   A.intersection(B).intersection(C)]
-
-    all_members = [random.sample(list(members), 3) if len(members) > 3 else members for members in all_members]
-    all_members = set.union(*[set(s) for s in all_members])
+    # Randomly select members (the regions of the selected members are the selected members of each region)
+    regions = get_regions([set(sets[name]) for name in relevant_sets])
+    regions = [set(random.sample(list(members), 3)) if len(members) > 3 else members for members in regions]
+    all_members = set.union(*regions)
     sets = [set(sets[name]).intersection(all_members) for name in relevant_sets] 
-    return sets, set_labels
+    return sets, set_labels, regions
         
     
+def get_venn_sets(wordnet, world):
+    """
+    Get the sets (subclasses of the world synset) that can be drawn in a Venn diagram
+    :param wordnet: the WordNetHelper
+    :param world: the synset to start from
+    :return: a dictionary of set names to member names, and a dictionary of set names
+    to the names of the sets that intersect with them
+    """
+    # All of the possible sets (dictionary of names to members)
+    subclasses = wordnet.get_subclasses(world)
+    sets = {wordnet.get_name(subclass): wordnet.get_members(subclass)
+            for subclass in subclasses}
+
+    # Only keep sets that contain at least 3 members
+    sets = {name: members for name, members in sets.items() if len(members) >= 3}
+
+    # We need 2 or 3 sets for the Venn
+    if len(sets) < 2:
+        return {}, {}
+
+    # Set name to member names
+    sets = {name: [wordnet.get_name(member) for member in subclass]
+            for name, subclass in sets.items()}
+
+    # Take only sets that have intersection
+    return sets, find_intersections(sets)
+
+
+def find_intersections(sets):
+    """
+    Find the pairs of sets that share members, using an inverted index from each member to its sets
+    (instead of intersecting every pair of sets). Each set and two of the sets it intersects
+    with form a candidate triple for a 3 set Venn diagram.
+    :param sets: a dictionary of set names to member names
+    :return: a dictionary of set names to the names of the sets that intersect with them
+    """
+    member_to_sets = defaultdict(set)
+    for name, members in sets.items():
+        for member in members:
+            member_to_sets[member].add(name)
+
+    intersections = {name: set() for name in sets}
+    for names in member_to_sets.values():
+        if len(names) > 1:
+            for name in names:
+                intersections[name].update(names)
+
+    for name, others in intersections.items():
+        others.discard(name)
+
+    return intersections
+
+
+def draw_random_venn(sets, intersections, filename=None):
+    """
+    Draw a random Venn diagram from the given sets
+    :return: whether a Venn diagram could be drawn
+    """
+    plt.clf()
+
+    # Try 3 first
+    result = generate_random_venn3(intersections, sets)
+
+    if result is not None:
+        sets, set_labels, regions = result
+        draw_venn3(*sets, set_labels=set_labels, filename=filename, regions=regions)
+        return True
+
+    # Try 2
+    result = generate_random_venn2(intersections, sets)
+    if result is not None:
+        sets, set_labels, regions = result
+        draw_venn2(*sets, set_labels=set_labels, filename=filename, regions=regions)
+        return True
+
+    return False
+
+
 def generate_random_venn(wordnet, filename=None):
     found = False
 
     while not found:
-        plt.clf()
-        
         # Random world to start from
         world = wordnet.get_random_synset()
-        
-        # All of the possible sets (dictionary of names to members) 
-        subclasses = wordnet.get_subclasses(world)
-        sets = {wordnet.get_name(subclass): wordnet.get_members(subclass)
-                for subclass in subclasses}
-        
-        # Only keep sets that contain at least 3 members
-        sets = {name: members for name, members in sets.items() if len(members) >= 3}
+        sets, intersections = get_venn_sets(wordnet, world)
 
-        # We need 2 or 3 sets for the Venn
-        if len(sets) < 2:
-            continue
+        if len(sets) > 0:
+            found = draw_random_venn(sets, intersections, filename=filename)
 
-        # Set name to member names
-        sets = {name: [wordnet.get_name(member) for member in subclass]
-                for name, subclass in sets.items()}
 
-        # Take only sets that have intersection
-        intersections = {name: {oname for oname, omems in sets.items()
-                               if oname != name and len(set(mems).intersection(set(omems))) > 0} 
-                         for name, mems in sets.items()}
-        
-        # Try 3 first
-        result = generate_random_venn3(intersections, sets)
-        
-        if result is not None:
-            sets, set_labels = result
-            found = True
-            draw_venn3(*sets, set_labels=set_labels, filename=filename)
+def build_venn_index(wordnet, filename):
+    """
+    Enumerate all the synsets that yield a valid 2 or 3 set Venn diagram, and save their sets
+    (only the sets that intersect with another set) to a gzipped JSON file
+    """
+    candidates = []
+
+    for world in wn.all_synsets():
+        sets, intersections = get_venn_sets(wordnet, world)
+        relevant = [name for name, others in intersections.items() if len(others) > 0]
+
+        if len(relevant) > 0:
+            candidates.append({'world': world.name(), 'sets': {name: sets[name] for name in relevant}})
+
+    with gzip.open(filename, 'wt', encoding='utf-8') as f_out:
+        json.dump(candidates, f_out, separators=(',', ':'))
+
+    print('Saved {} Venn candidates to {}'.format(len(candidates), filename))
+
+
+def load_venn_index(filename):
+    """
+    Load the Venn candidates saved by build_venn_index
+    """
+    with gzip.open(filename, 'rt', encoding='utf-8') as f_in:
+        return json.load(f_in)
+
+
+def generate_venn_from_index(venn_index, filename=None):
+    """
+    Draw a random Venn diagram from a random candidate in the index
+    """
+    candidate = random.choice(venn_index)
+    sets = candidate['sets']
+    draw_random_venn(sets, find_intersections(sets), filename=filename)
+
+
+# The state of each rendering process
+worker_wordnet, worker_venn_index, worker_counter = None, None, None
+
+
+def init_render_worker(index_file):
+    """
+    Loads the Venn index (or WordNet) and creates a single figure that is reused by all the renders
+    """
+    global worker_wordnet, worker_venn_index, worker_counter
+    plt.switch_backend('Agg')
+    plt.figure()
+
+    worker_wordnet = WordNetHelper()
+    worker_venn_index = load_venn_index(index_file) if index_file is not None else None
+    worker_counter = itertools.count()
+
+
+def render_venn(queue_dir):
+    """
+    Renders a random Venn diagram into the queue directory, under a unique file name.
+    The file is renamed only after it is complete, so the poster never reads a partial image.
+    :return: the time it took to render the diagram, or None if the rendering failed
+    """
+    start = time.time()
+    name = 'venn_{}_{}_{}'.format(time.time_ns(), os.getpid(), next(worker_counter))
+    temp_file = os.path.join(queue_dir, name + '.tmp')
+
+    # A single bad diagram shouldn't stop the producer
+    try:
+        if worker_venn_index is not None:
+            generate_venn_from_index(worker_venn_index, filename=temp_file)
         else:
-            # Try 2
-            result = generate_random_venn2(intersections, sets)
-            if result is not None:
-                sets, set_labels = result 
-                found = True
-                draw_venn2(*sets, set_labels=set_labels, filename=filename)
+            generate_random_venn(worker_wordnet, filename=temp_file)
+
+        os.rename(temp_file, os.path.join(queue_dir, name + '.png'))
+    except Exception as err:
+        print('Failed rendering a diagram: {}'.format(err))
+
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+        return None
+
+    return time.time() - start
+
+
+def produce_venn_queue(queue_dir, max_queued=100, processes=4, index_file=None, poll_interval=10):
+    """
+    Keeps the queue directory filled with up to max_queued pre-rendered diagrams, using a pool of processes
+    """
+    os.makedirs(queue_dir, exist_ok=True)
+    pool = multiprocessing.Pool(processes, initializer=init_render_worker, initargs=(index_file,))
+
+    try:
+        while True:
+            missing = max_queued - len(glob.glob(os.path.join(queue_dir, '*.png')))
+
+            if missing <= 0:
+                time.sleep(poll_interval)
+                continue
+
+            start = time.time()
+            render_times = [t for t in pool.map(render_venn, [queue_dir] * missing) if t is not None]
+            elapsed = time.time() - start
+
+            if len(render_times) == 0:
+                print('Failed rendering {} diagrams'.format(missing))
+                time.sleep(poll_interval)
+                continue
+
+            print('Rendered {} diagrams in {:.2f}s ({:.2f} diagrams/s, {:.2f}s per diagram), {} failed'.format(
+                len(render_times), elapsed, len(render_times) / elapsed, sum(render_times) / len(render_times),
+                missing - len(render_times)))
+    finally:
+        pool.terminate()
+
+
+def dequeue_venn(queue_dir):
+    """
+    Returns the oldest pre-rendered diagram in the queue directory, or None if the queue is empty
+    """
+    queued = sorted(glob.glob(os.path.join(queue_dir, '*.png')))
+    return queued[0] if len(queued) > 0 else None
 
 
 if __name__ == "__main__":
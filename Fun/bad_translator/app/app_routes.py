@@ -1,19 +1,96 @@
 import os
 import html
+import time
 import random
 
-from flask import Flask, render_template, request
-from google.cloud import translate_v2 as translate
+from flask import Flask, jsonify, render_template, request
+
+from translation_cache import TranslationCache
+from translation_backends import get_client, get_supported_languages
 
 app = Flask(__name__)
 
-def get_client():
-  return translate.Client.from_service_account_json(os.path.expanduser("~/service_account.json"))
+# The maximal number of text segments in a single request to the Translate v2 API
+MAX_SEGMENTS = 128
+
+# Translations of (source, target, text) repeat across users and sessions
+translation_cache = TranslationCache(maxsize=int(os.environ.get("BAD_TRANSLATOR_CACHE_SIZE", "100000")),
+                                     filename=os.environ.get("BAD_TRANSLATOR_CACHE_FILE"))
 
 
 def translate_text(translate_client, source, target, text):
-  result = translate_client.translate(text, target_language=target, source_language=source)
-  return html.unescape(result["translatedText"])
+  translation = translation_cache.get(source, target, text)
+
+  if translation is None:
+    result = translate_client.translate(text, target_language=target, source_language=source)
+    translation = html.unescape(result["translatedText"])
+    translation_cache.put(source, target, text, translation)
+
+  return translation
+
+
+def translate_texts(translate_client, source, target, texts):
+  """
+  Translates many texts with a single call (per MAX_SEGMENTS texts) for all the texts that aren't in the cache
+  """
+  translations, missing = find_missing(source, target, texts)
+  results = []
+
+  for chunk in chunked(missing):
+    results.extend(translate_client.translate(chunk, target_language=target, source_language=source))
+
+  return merge_translations(source, target, texts, translations, missing, results)
+
+
+def find_missing(source, target, texts):
+  """
+  Looks up the texts in the cache
+  :return: the cached translation of each text (None if it isn't cached), and the sorted distinct missing texts
+  """
+  translations = [translation_cache.get(source, target, text) for text in texts]
+  missing = sorted({text for text, translation in zip(texts, translations) if translation is None})
+  return translations, missing
+
+
+def merge_translations(source, target, texts, translations, missing, results):
+  """
+  Adds the translations of the missing texts to the cache, and fills them in the list of translations
+  :param results: the translation service results of the missing texts (in the same order)
+  :return: the translation of each text
+  """
+  if len(missing) == 0:
+    return translations
+
+  new_translations = {text: html.unescape(result["translatedText"]) for text, result in zip(missing, results)}
+  translation_cache.put_many(source, target, new_translations)
+  return [new_translations[text] if translation is None else translation
+          for text, translation in zip(texts, translations)]
+
+
+def chunked(texts, size=MAX_SEGMENTS):
+  """
+  Splits the texts to lists of at most `size` texts, the maximal number of texts in a single translate call
+  """
+  return [texts[i:i + size] for i in range(0, len(texts), size)]
+
+
+def parse_texts(request_json):
+  """
+  Returns the list of texts in a batch request ({"texts": [...]}), or None if the request is invalid
+  """
+  texts = request_json.get("texts") if isinstance(request_json, dict) else None
+
+  if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+    return None
+
+  return texts
+
+
+def random_language_chain(supported_languages, length=10):
+  """
+  Returns a random chain of languages, that ends with English
+  """
+  return list(random.choices([lang for lang in supported_languages if lang != "en"], k=length - 1)) + ["en"]
 
 
 @app.route('/')
@@ -27,13 +104,12 @@ def data():
     input = request.form["inputText"]
 
     # Get the list of languages that Google Translate supports
+    start = time.time()
     translate_client = get_client()
-    results = translate_client.get_languages()
-    supported_languages = [lang["language"] for lang in results]
-    supported_languages.remove("en")
+    supported_languages = get_supported_languages(translate_client)
 
     # Random chain of languages
-    targets = list(random.choices(supported_languages, k=9)) + ["en"]
+    targets = random_language_chain(supported_languages)
     print(f"Translating to {targets}")
 
     # Translate
@@ -43,8 +119,36 @@ def data():
         curr = translate_text(translate_client, source, target, curr)
         source = target
 
+    print(f"Translated in {time.time() - start:.2f}s")
     return render_template('bad_translator.html', input=input, output=curr)
 
 
+@app.route('/bad_translator/batch', methods=['POST'])
+def batch():
+  """
+  Translates many texts through the same random chain of languages, with a single translate call per hop.
+  Expects a JSON {"texts": [...]} and returns {"targets": [...], "outputs": [...]}.
+  """
+  texts = parse_texts(request.get_json(silent=True))
+  if texts is None:
+    return jsonify({"error": "expected a JSON object with a list of strings in \"texts\""}), 400
+
+  translate_client = get_client()
+  targets = random_language_chain(get_supported_languages(translate_client))
+
+  curr = texts
+  source = "en"
+  for target in targets:
+    curr = translate_texts(translate_client, source, target, curr)
+    source = target
+
+  return jsonify({"targets": targets, "outputs": curr})
+
+
+@app.route('/bad_translator/stats')
+def stats():
+  return jsonify(translation_cache.stats())
+
+
 if __name__ == '__main__':
   app.run(debug=True)
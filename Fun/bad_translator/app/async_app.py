@@ -0,0 +1,113 @@
+"""
+An ASGI version of the bad translator, e.g. `uvicorn async_app:app`.
+Translation calls are awaited, so a worker serves many concurrent requests while they wait for the service.
+"""
+import os
+import json
+import time
+import asyncio
+
+from urllib.parse import parse_qs
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from app_routes import translation_cache, random_language_chain, find_missing, merge_translations, chunked, parse_texts
+from translation_backends import get_async_client, get_supported_languages_async
+
+templates = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), "templates")),
+                        autoescape=select_autoescape())
+
+
+async def translate_texts(translate_client, source, target, texts):
+  """
+  Translates many texts with a single call (per MAX_SEGMENTS texts) for all the texts that aren't in the cache
+  """
+  translations, missing = await run_cache_operation(find_missing, source, target, texts)
+  chunk_results = await asyncio.gather(*[
+    translate_client.translate(chunk, target_language=target, source_language=source) for chunk in chunked(missing)])
+  results = [result for chunk_result in chunk_results for result in chunk_result]
+  return await run_cache_operation(merge_translations, source, target, texts, translations, missing, results)
+
+
+async def run_cache_operation(function, *args):
+  """
+  Runs a function that accesses the translation cache. If the cache is saved to disk,
+  it runs in a thread, so that the disk access doesn't block the event loop.
+  """
+  if translation_cache.db is None:
+    return function(*args)
+
+  return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+async def translate_chain(texts):
+  """
+  Translates the texts through the same random chain of languages, with a single translate call per hop
+  """
+  translate_client = get_async_client()
+  targets = random_language_chain(await get_supported_languages_async(translate_client))
+
+  curr = texts
+  source = "en"
+  for target in targets:
+    curr = await translate_texts(translate_client, source, target, curr)
+    source = target
+
+  return targets, curr
+
+
+async def app(scope, receive, send):
+  if scope["type"] != "http":
+    return
+
+  path, method = scope["path"], scope["method"]
+  body = await read_body(receive)
+
+  if path == "/" and method == "GET":
+    await send_response(send, 200, "text/html", templates.get_template("bad_translator.html").render())
+
+  elif path == "/bad_translator/" and method == "POST":
+    start = time.time()
+    input = parse_qs(body.decode("utf-8")).get("inputText", [""])[0]
+    targets, outputs = await translate_chain([input])
+    print(f"Translating to {targets}, translated in {time.time() - start:.2f}s")
+    html_output = templates.get_template("bad_translator.html").render(input=input, output=outputs[0])
+    await send_response(send, 200, "text/html", html_output)
+
+  elif path == "/bad_translator/batch" and method == "POST":
+    try:
+      texts = parse_texts(json.loads(body))
+    except ValueError:
+      texts = None
+
+    if texts is None:
+      await send_response(send, 400, "application/json",
+                          json.dumps({"error": "expected a JSON object with a list of strings in \"texts\""}))
+      return
+
+    targets, outputs = await translate_chain(texts)
+    await send_response(send, 200, "application/json", json.dumps({"targets": targets, "outputs": outputs}))
+
+  elif path == "/bad_translator/stats" and method == "GET":
+    await send_response(send, 200, "application/json", json.dumps(translation_cache.stats()))
+
+  else:
+    await send_response(send, 404, "text/plain", "Not found")
+
+
+async def read_body(receive):
+  body, more_body = b"", True
+
+  while more_body:
+    message = await receive()
+    body += message.get("body", b"")
+    more_body = message.get("more_body", False)
+
+  return body
+
+
+async def send_response(send, status, content_type, text):
+  data = text.encode("utf-8")
+  await send({"type": "http.response.start", "status": status,
+              "headers": [(b"content-type", content_type.encode("utf-8") + b"; charset=utf-8"),
+                          (b"content-length", str(len(data)).encode("utf-8"))]})
+  await send({"type": "http.response.body", "body": data})
@@ -0,0 +1,67 @@
+"""
+A load test for the bad translator. Start the app with the fake backend, e.g.:
+
+  BAD_TRANSLATOR_BACKEND=fake python app_routes.py
+  BAD_TRANSLATOR_BACKEND=fake uvicorn async_app:app --port 5000
+
+and then run: python load_test.py --url http://127.0.0.1:5000
+"""
+import json
+import time
+import random
+import argparse
+import urllib.parse
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+
+WORDS = ["the", "cat", "sat", "on", "a", "mat", "and", "ate", "my", "homework", "very", "quickly"]
+
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument('--url', default='http://127.0.0.1:5000', help='the address of the running app')
+  ap.add_argument('--requests', type=int, default=200, help='the total number of requests')
+  ap.add_argument('--concurrency', type=int, default=20, help='the number of concurrent clients')
+  ap.add_argument('--batch_size', type=int, default=0,
+                  help='send batches of texts to /bad_translator/batch instead of single texts (0 for single)')
+  args = ap.parse_args()
+
+  send = (lambda: send_batch(args.url, args.batch_size)) if args.batch_size > 0 else (lambda: send_single(args.url))
+
+  start = time.time()
+  with ThreadPoolExecutor(args.concurrency) as executor:
+    latencies = sorted(executor.map(lambda _: timed(send), range(args.requests)))
+
+  elapsed = time.time() - start
+  texts = args.requests * max(args.batch_size, 1)
+  print(f"{args.requests} requests in {elapsed:.2f}s: {args.requests / elapsed:.1f} requests/s, "
+        f"{texts / elapsed:.1f} texts/s")
+  print(f"Latency: p50={latencies[len(latencies) // 2] * 1000:.0f}ms, "
+        f"p99={latencies[min(int(0.99 * len(latencies)), len(latencies) - 1)] * 1000:.0f}ms")
+
+
+def random_text():
+  return " ".join(random.choices(WORDS, k=random.randint(3, 10)))
+
+
+def send_single(url):
+  data = urllib.parse.urlencode({"inputText": random_text()}).encode("utf-8")
+  urllib.request.urlopen(url + "/bad_translator/", data=data).read()
+
+
+def send_batch(url, batch_size):
+  data = json.dumps({"texts": [random_text() for _ in range(batch_size)]}).encode("utf-8")
+  request = urllib.request.Request(url + "/bad_translator/batch", data=data,
+                                   headers={"Content-Type": "application/json"})
+  urllib.request.urlopen(request).read()
+
+
+def timed(function):
+  start = time.time()
+  function()
+  return time.time() - start
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,195 @@
+import os
+import time
+import random
+import asyncio
+import threading
+
+SERVICE_ACCOUNT_FILE = os.path.expanduser("~/service_account.json")
+POOL_SIZE = 32
+LANGUAGES_TTL = 24 * 3600
+
+_client = None
+_client_lock = threading.Lock()
+_languages = None
+_languages_time = 0
+_async_client = None
+
+
+def get_client():
+  """
+  Returns the process-wide translation client, creating it on the first call.
+  The backend is selected with the BAD_TRANSLATOR_BACKEND environment variable ("google" or "fake").
+  """
+  global _client
+
+  if _client is None:
+    with _client_lock:
+      if _client is None:
+        backend = os.environ.get("BAD_TRANSLATOR_BACKEND", "google")
+        _client = make_fake_client() if backend == "fake" else make_google_client()
+
+  return _client
+
+
+def get_async_client():
+  """
+  Returns the process-wide asynchronous translation client (for the ASGI app), creating it on the first call.
+  The backend is selected with the BAD_TRANSLATOR_BACKEND environment variable ("google" or "fake").
+  """
+  global _async_client
+
+  if _async_client is None:
+    if os.environ.get("BAD_TRANSLATOR_BACKEND", "google") == "fake":
+      _async_client = AsyncFakeTranslateClient(latency=float(os.environ.get("BAD_TRANSLATOR_FAKE_LATENCY", "0.05")))
+    else:
+      from google.oauth2 import service_account
+      from google.cloud import translate_v2 as translate
+
+      credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE,
+                                                                          scopes=translate.Client.SCOPE)
+      _async_client = AsyncGoogleTranslateClient(credentials)
+
+  return _async_client
+
+
+def make_google_client():
+  """
+  Creates a Google Translate client with a pooled HTTP session, shared by all the requests
+  """
+  import requests
+
+  from google.oauth2 import service_account
+  from google.cloud import translate_v2 as translate
+  from google.auth.transport.requests import AuthorizedSession
+
+  credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE,
+                                                                      scopes=translate.Client.SCOPE)
+  session = AuthorizedSession(credentials)
+  session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE))
+  return translate.Client(credentials=credentials, _http=session)
+
+
+def make_fake_client():
+  """
+  Creates a local fake client, for measuring latency without the real service
+  """
+  latency = float(os.environ.get("BAD_TRANSLATOR_FAKE_LATENCY", "0.05"))
+  return FakeTranslateClient(latency=latency)
+
+
+def get_supported_languages(translate_client):
+  """
+  Returns the list of languages that the translation service supports, cached for LANGUAGES_TTL seconds
+  """
+  global _languages, _languages_time
+
+  if _languages is None or time.time() - _languages_time > LANGUAGES_TTL:
+    _languages = [lang["language"] for lang in translate_client.get_languages()]
+    _languages_time = time.time()
+
+  return _languages
+
+
+async def get_supported_languages_async(translate_client):
+  """
+  Returns the list of languages that the translation service supports, cached for LANGUAGES_TTL seconds
+  """
+  global _languages, _languages_time
+
+  if _languages is None or time.time() - _languages_time > LANGUAGES_TTL:
+    _languages = [lang["language"] for lang in await translate_client.get_languages()]
+    _languages_time = time.time()
+
+  return _languages
+
+
+class FakeTranslateClient:
+  """
+  A local replacement for the Google Translate client: returns the text with some words swapped,
+  after a fixed delay that simulates the network round trip
+  """
+  LANGUAGES = ["en", "fr", "de", "es", "it", "pt", "nl", "sv", "fi", "pl", "tr", "he", "ja", "zh"]
+
+  def __init__(self, latency=0.05):
+    self.latency = latency
+
+  def get_languages(self):
+    time.sleep(self.latency)
+    return [{"language": lang, "name": lang} for lang in self.LANGUAGES]
+
+  def translate(self, values, target_language=None, source_language=None):
+    time.sleep(self.latency)
+
+    # Like the real client, a list of texts returns a list of results
+    if isinstance(values, list):
+      return [{"translatedText": self._translate(text, target_language)} for text in values]
+
+    return {"translatedText": self._translate(values, target_language)}
+
+  def _translate(self, text, target):
+    # Shuffle the words a bit to make the fake translation "bad"
+    words = text.split()
+    if len(words) > 1 and random.random() < 0.3:
+      i = random.randrange(len(words) - 1)
+      words[i], words[i + 1] = words[i + 1], words[i]
+
+    return " ".join(words)
+
+
+class AsyncFakeTranslateClient(FakeTranslateClient):
+  """
+  An asynchronous version of FakeTranslateClient: the simulated round trip doesn't block the event loop
+  """
+  async def get_languages(self):
+    await asyncio.sleep(self.latency)
+    return [{"language": lang, "name": lang} for lang in self.LANGUAGES]
+
+  async def translate(self, values, target_language=None, source_language=None):
+    await asyncio.sleep(self.latency)
+
+    if isinstance(values, list):
+      return [{"translatedText": self._translate(text, target_language)} for text in values]
+
+    return {"translatedText": self._translate(values, target_language)}
+
+
+class AsyncGoogleTranslateClient:
+  """
+  An asynchronous client for the Google Translate v2 REST API (the same API as translate_v2.Client),
+  with a pool of keep-alive connections
+  """
+  URL = "https://translation.googleapis.com/language/translate/v2"
+
+  def __init__(self, credentials, pool_size=POOL_SIZE):
+    import httpx
+
+    self.credentials = credentials
+    self.http = httpx.AsyncClient(limits=httpx.Limits(max_connections=pool_size,
+                                                      max_keepalive_connections=pool_size))
+    self.lock = asyncio.Lock()
+
+  async def get_languages(self):
+    response = await self.http.get(self.URL + "/languages", headers=await self._headers())
+    response.raise_for_status()
+    return response.json()["data"]["languages"]
+
+  async def translate(self, values, target_language=None, source_language=None):
+    texts = values if isinstance(values, list) else [values]
+    request = {"q": texts, "target": target_language}
+    if source_language is not None:
+      request["source"] = source_language
+
+    response = await self.http.post(self.URL, json=request, headers=await self._headers())
+    response.raise_for_status()
+    translations = response.json()["data"]["translations"]
+    return translations if isinstance(values, list) else translations[0]
+
+  async def _headers(self):
+    from google.auth.transport.requests import Request
+
+    # Refresh the access token (rarely) in a thread, to avoid blocking the event loop
+    async with self.lock:
+      if not self.credentials.valid:
+        await asyncio.get_running_loop().run_in_executor(None, self.credentials.refresh, Request())
+
+    return {"Authorization": "Bearer " + self.credentials.token}
@@ -0,0 +1,93 @@
+import sqlite3
+import threading
+
+from collections import OrderedDict
+
+
+class TranslationCache:
+  """
+  A bounded LRU cache of translations keyed by (source, target, text), optionally persisted
+  to an SQLite file so that it survives restarts and is shared between processes
+  """
+  def __init__(self, maxsize=100000, filename=None):
+    self.maxsize = maxsize
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits, self.disk_hits, self.misses = 0, 0, 0
+    self.db = None
+
+    if filename is not None:
+      self.db = sqlite3.connect(filename, check_same_thread=False)
+      self.db.execute("CREATE TABLE IF NOT EXISTS translations "
+                      "(source TEXT, target TEXT, text TEXT, translation TEXT, PRIMARY KEY (source, target, text))")
+      self.db.commit()
+
+  def get(self, source, target, text):
+    """
+    Returns the cached translation, or None if it's not in the cache
+    """
+    key = (source, target, text)
+
+    with self.lock:
+      if key in self.entries:
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+      if self.db is not None:
+        row = self.db.execute("SELECT translation FROM translations WHERE source = ? AND target = ? AND text = ?",
+                              key).fetchone()
+        if row is not None:
+          self.disk_hits += 1
+          self._add(key, row[0])
+          return row[0]
+
+      self.misses += 1
+      return None
+
+  def put(self, source, target, text, translation):
+    """
+    Adds a translation to the cache (and to the disk, if persisted)
+    """
+    key = (source, target, text)
+
+    with self.lock:
+      self._add(key, translation)
+
+      if self.db is not None:
+        self.db.execute("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)", key + (translation,))
+        self.db.commit()
+
+  def put_many(self, source, target, translations):
+    """
+    Adds a dictionary of text -> translation to the cache, with a single disk write
+    """
+    keys = [(source, target, text) for text in translations]
+
+    with self.lock:
+      for key in keys:
+        self._add(key, translations[key[2]])
+
+      if self.db is not None:
+        self.db.executemany("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+                            [key + (translations[key[2]],) for key in keys])
+        self.db.commit()
+
+  def stats(self):
+    """
+    Returns the hit and miss counters
+    """
+    with self.lock:
+      lookups = self.hits + self.disk_hits + self.misses
+      return {"hits": self.hits,
+              "disk_hits": self.disk_hits,
+              "misses": self.misses,
+              "hit_rate": (self.hits + self.disk_hits) / max(lookups, 1),
+              "size": len(self.entries)}
+
+  def _add(self, key, translation):
+    self.entries[key] = translation
+    self.entries.move_to_end(key)
+
+    if 0 < self.maxsize < len(self.entries):
+      self.entries.popitem(last=False)
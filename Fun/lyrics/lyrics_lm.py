@@ -1,23 +1,35 @@
+import os
 import sys
+import json
+import time
 import codecs
+import resource
 import random
 import logging
 
 import dynet as dy
 import numpy as np
 
+from array import array
 from docopt import docopt
 from itertools import count
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+
+from numpy_lm import NumpyLanguageModel, sample_from_logits
 
 LAYERS = 2
 HIDDEN_DIM = 50
 VOCAB_SIZE = 0
 START = '<s>'
 END = '</s>'
+UNK = '<unk>'
 MAX_ITERS = 100 # Max training iterations
-PATIENCE = 10 # How many epochs without improving loss to wait before stopping training
+PATIENCE = 10 # How many epochs without improving the (held-out) loss to wait before stopping training
 DISPLAY_FREQ = 50 # How often to sample a sentence and display it, during training
+MAX_CACHED_STATES = 1000 # How many generation states (prefixes) to keep in the cache
+PROBE_LENGTH = 20 # The length of the sentence used to verify the model exported to NumPy
+EXPORT_TOLERANCE = 1e-4 # The maximal log-probability difference between the exported model and DyNet
+CHUNK_SIZE = 10000000 # How many tokens of the encoded corpus to process at once
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
@@ -28,22 +40,47 @@ def main():
         Based on: https://github.com/clab/dynet/blob/5049e5995f169fe1798139e1ca4dc98a7c0c4317/examples/rnnlm/rnnlm.py
 
         Usage:
-            lyrics_lm.py <corpus> <embeddings_file> <embeddings_dim> <model_name>
+            lyrics_lm.py [options] <corpus> <embeddings_file> <embeddings_dim> <model_name>
 
             Arguments:
                 corpus              the input text corpus file.
                 embeddings_file     the pre-trained embedding file in a textual format.
                 embeddings_dim      the dimension of the pre-trained embeddings. 
                 model_name          the model name, used for the model and prediction files.
-        """)
+
+        Options:
+            --batch_size=<n>    the number of sentences in each minibatch (sentences of similar lengths
+                                are batched together) [default: 1].
+            --min_count=<n>     replace words that occur less than n times in the corpus with {unk} [default: 1].
+            --max_vocab=<n>     keep only the n most frequent words in the vocabulary (0 for no limit) [default: 0].
+            --num_sampled=<n>   train with a sampled softmax over the targets and n words sampled from
+                                the unigram distribution, instead of the full softmax (0 for full softmax)
+                                [default: 0].
+            --dev_size=<n>      the number of sentences to hold out for computing the perplexity after each epoch.
+                                When 0, early stopping uses the training loss [default: 0].
+            --log_file=<file>   where to write the per-epoch statistics, as JSON lines
+                                (default: <model_name>.train_log.jsonl).
+        """.format(unk=UNK))
     corpus = args['<corpus>']
     embeddings_file = args['<embeddings_file>']
     embeddings_dim = int(args['<embeddings_dim>'])
     model_name = args['<model_name>']
+    batch_size = int(args['--batch_size'])
+    min_count = int(args['--min_count'])
+    max_vocab = int(args['--max_vocab'])
+    num_sampled = int(args['--num_sampled'])
+    dev_size = int(args['--dev_size'])
+    log_file = args['--log_file'] or model_name + '.train_log.jsonl'
 
     logger.info('Loading the corpus from: {}'.format(corpus))
     training_corpus = CorpusReader(corpus)
-    vocabulary = training_corpus.get_distinct_vocab()
+    encoded_corpus = training_corpus.get_encoded()
+
+    if min_count > 1 or max_vocab > 0:
+        encoded_corpus.restrict_vocab(min_count=min_count, max_size=max_vocab)
+        logger.info('Restricted the vocabulary to {} words'.format(len(encoded_corpus.vocab)))
+
+    vocabulary = encoded_corpus.vocab
     word2index = {w: i for i, w in enumerate(list(vocabulary))}
     vocab = Vocab(word2index)
 
@@ -57,64 +94,106 @@ def main():
                           pretrained_embeddings=wv)
 
     logger.info('Training...')
-    train = list(training_corpus)
+    train = encoded_corpus.sentences()
+    sampler = NegativeSampler(encoded_corpus.word_counts(), num_sampled) if num_sampled > 0 else None
+
+    random.shuffle(train)
+    dev, train = train[:dev_size], train[dev_size:]
 
     words = loss = 0.0
-    previous_loss = np.infty
+    best_loss = np.inf
     num_iters_since_last_improved = 0
-
-    for iter in range(MAX_ITERS):
-        random.shuffle(train)
-        for i, sent in enumerate(train):
-
-            # Display the current status
-            if i % DISPLAY_FREQ == 0:
-                trainer.status()
-                if words > 0:
-                    logger.debug('{}, {}'.format(i, loss / words))
-
-                sample = lm.sample(first=vocab.w2i[START], stop=vocab.w2i[END], nwords=10)
-                print(' '.join([vocab.i2w[w] for w in sample]).strip())
-                loss = 0.0
-                words = 0.0
-
-            words += len(sent)
-            isent = [vocab.w2i[w] for w in sent]
-            errs = lm.build_lm_graph(isent)
-
-            # Early stopping if the loss stopped improving PATIENCE iterations ago
-            loss += errs.scalar_value()
-            errs.backward()
-            trainer.update()
-
-            if previous_loss > loss:
-                num_iters_since_last_improved += 1
-            else:
+    start_time = time.time()
+
+    with codecs.open(log_file, 'w', 'utf-8') as f_log:
+        for iter in range(MAX_ITERS):
+            epoch_start = time.time()
+            epoch_words = epoch_loss = forward_time = backward_time = update_time = 0.0
+
+            for i, batch in enumerate(make_batches(train, batch_size)):
+
+                # Display the current status
+                if i % DISPLAY_FREQ == 0:
+                    trainer.status()
+                    if words > 0:
+                        logger.debug('{}, {}, {:.1f} tokens/sec'.format(
+                            i, loss / words, words / (time.time() - start_time)))
+
+                    sample = lm.sample(first=vocab.w2i[START], stop=vocab.w2i[END], nwords=10)
+                    print(' '.join([vocab.i2w[w] for w in sample]).strip())
+                    loss = 0.0
+                    words = 0.0
+                    start_time = time.time()
+
+                step_start = time.time()
+                errs, num_words = lm.build_lm_graph_batch(batch, sampler=sampler)
+                batch_loss = errs.scalar_value()
+                forward_end = time.time()
+                errs.backward()
+                backward_end = time.time()
+                trainer.update()
+                update_end = time.time()
+
+                # The cached generation states were computed with the previous parameters
+                lm.clear_state_cache()
+
+                forward_time += forward_end - step_start
+                backward_time += backward_end - forward_end
+                update_time += update_end - backward_end
+
+                words += num_words
+                loss += batch_loss
+                epoch_words += num_words
+                epoch_loss += batch_loss
+
+            epoch_time = time.time() - epoch_start
+            stats = {'epoch': iter,
+                     'train_loss': epoch_loss / max(epoch_words, 1),
+                     'tokens_per_sec': epoch_words / max(epoch_time, 1e-9),
+                     'epoch_time': epoch_time,
+                     'forward_time': forward_time,
+                     'backward_time': backward_time,
+                     'update_time': update_time,
+                     'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+
+            if len(dev) > 0:
+                _, stats['dev_perplexity'] = lm.score_sentences(dev)
+
+            f_log.write(json.dumps(stats) + '\n')
+            f_log.flush()
+            print('Iteration: {}, {}'.format(iter, ', '.join('{}={:.4g}'.format(k, v) for k, v in stats.items())))
+            trainer.status()
+
+            # Early stopping if the (held-out) loss stopped improving PATIENCE epochs ago
+            curr_loss = stats.get('dev_perplexity', stats['train_loss'])
+            if curr_loss < best_loss:
+                best_loss = curr_loss
                 num_iters_since_last_improved = 0
-
-            previous_loss = loss
+            else:
+                num_iters_since_last_improved += 1
 
             if num_iters_since_last_improved == PATIENCE:
                 logger.info('Lost patience, stopping training')
                 break
 
-        print('Iteration: {}, loss={}'.format(iter, loss))
-        trainer.status()
-
     logger.info('Done training.')
 
     model_file = model_name + '.model'
     logger.info('Saving the model to: {}'.format(model_file))
     lm.save_to_disk(model_file)
 
+    numpy_model_file = model_name + '.npz'
+    logger.info('Exporting the model for NumPy inference to: {}'.format(numpy_model_file))
+    lm.export_to_numpy(numpy_model_file, vocab)
+
     logger.info('Loading the saved model from: {}'.format(model_file))
     lm.load_from_disk(model_file)
 
     logger.info('Sampling a text (in the form of a song):')
     with codecs.open(model_name + '.sample', 'w', 'utf-8') as f_out:
         start_index, end_index = vocab.w2i[START], vocab.w2i[END]
-        for i in range(25):
-            sample = lm.sample(first=vocab.w2i[START], stop=vocab.w2i[END], nwords=10)
+        samples = lm.sample_batch(25, first=start_index, stop=end_index, nwords=10)
+        for i, sample in enumerate(samples):
             sentence = ' '.join([vocab.i2w[w] for w in sample if w != start_index and w != end_index]).strip()
             f_out.write(sentence + '\n')
             print(sentence)
@@ -155,14 +234,51 @@ class CorpusReader:
         Returns all the distinct words in the corpus
         :return: all the distinct words in the corpus
         """
-        return list(set([w for sent in self.__iter__() for w in sent]))
+        return list(set(w for sent in self.__iter__() for w in sent))
+
+    def get_encoded(self):
+        """
+        Returns the integer-encoded corpus, encoding it first if it wasn't encoded yet
+        (or if the corpus file changed since it was encoded)
+        :return: an EncodedCorpus object
+        """
+        prefix = self.fname + '.encoded'
+
+        if not os.path.exists(prefix + '.vocab') or \
+                os.path.getmtime(prefix + '.vocab') < os.path.getmtime(self.fname):
+            logger.info('Encoding the corpus to: {}'.format(prefix))
+            self.encode(prefix)
+
+        return EncodedCorpus(prefix)
+
+    def encode(self, prefix):
+        """
+        Encodes the corpus in a single pass, and saves it as a flat array of word IDs (<prefix>.tokens.npy),
+        the start offset of each sentence in this array (<prefix>.offsets.npy),
+        and the vocabulary, one word per line, in the order of their IDs (<prefix>.vocab)
+        :param prefix: the output file name prefix
+        """
+        w2i = {START: 0, END: 1}
+        tokens, offsets = array('i'), array('l', [0])
+
+        for sent in self:
+            tokens.extend(w2i.setdefault(w, len(w2i)) for w in sent)
+            offsets.append(len(tokens))
+
+        np.save(prefix + '.tokens.npy', np.frombuffer(tokens, dtype=np.int32))
+        np.save(prefix + '.offsets.npy', np.array(offsets, dtype=np.int64))
+
+        # Saved last, so that its modification time marks a complete encoding
+        with codecs.open(prefix + '.vocab', 'w', 'utf-8') as f_out:
+            for w in sorted(w2i, key=w2i.get):
+                f_out.write(w + '\n')
 
     def __iter__(self):
         """
         Iterate over sentences from the corpus
         :return: the next sentence
         """
-        for line in file(self.fname):
+        for line in codecs.open(self.fname, 'r', 'utf-8'):
             line = line.strip().lower().split()
 
             # Only return non-empty lines. Append start and end symbols.
@@ -170,6 +286,139 @@ class CorpusReader:
                 yield [START] + line + [END]
 
 
+class EncodedCorpus:
+    """
+    A corpus encoded by CorpusReader.encode, memory-mapped from the disk
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.tokens = np.load(prefix + '.tokens.npy', mmap_mode='r')
+        self.offsets = np.load(prefix + '.offsets.npy', mmap_mode='r')
+
+        with codecs.open(prefix + '.vocab', 'r', 'utf-8') as f_in:
+            self.vocab = [line.rstrip('\n') for line in f_in]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def word_counts(self):
+        """
+        Returns the number of occurrences of each word in the corpus
+        :return: a numpy array of counts, in the order of the vocabulary
+        """
+        counts = np.zeros(len(self.vocab), dtype=np.int64)
+
+        # In chunks, to avoid copying the memory-mapped array
+        for start in range(0, len(self.tokens), CHUNK_SIZE):
+            counts += np.bincount(self.tokens[start:start + CHUNK_SIZE], minlength=len(self.vocab))
+
+        return counts
+
+    def restrict_vocab(self, min_count=1, max_size=0):
+        """
+        Keeps only the frequent words in the vocabulary, and replaces the other words in the corpus with UNK.
+        The new vocabulary is ordered by decreasing frequency, after the START, END and UNK symbols.
+        The restricted corpus is saved (<prefix>.min<min_count>.max<max_size>.tokens.npy and .vocab)
+        and memory-mapped, like the full corpus.
+        :param min_count: the minimal number of occurrences of a word to keep it
+        :param max_size: the maximal number of words to keep (0 for no limit)
+        """
+        restricted_prefix = '{}.min{}.max{}'.format(self.prefix, min_count, max_size)
+
+        if not os.path.exists(restricted_prefix + '.vocab') or \
+                os.path.getmtime(restricted_prefix + '.vocab') < os.path.getmtime(self.prefix + '.vocab'):
+            logger.info('Restricting the vocabulary of the corpus to: {}'.format(restricted_prefix))
+            self.save_restricted(restricted_prefix, min_count=min_count, max_size=max_size)
+
+        self.tokens = np.load(restricted_prefix + '.tokens.npy', mmap_mode='r')
+
+        with codecs.open(restricted_prefix + '.vocab', 'r', 'utf-8') as f_in:
+            self.vocab = [line.rstrip('\n') for line in f_in]
+
+    def save_restricted(self, prefix, min_count=1, max_size=0):
+        """
+        Saves the corpus with the restricted vocabulary (see restrict_vocab)
+        :param prefix: the output file name prefix
+        :param min_count: the minimal number of occurrences of a word to keep it
+        :param max_size: the maximal number of words to keep (0 for no limit)
+        """
+        counts = self.word_counts()
+        special = [self.vocab.index(START), self.vocab.index(END)]
+        counts[special] = -1
+
+        kept = [i for i in np.argsort(-counts, kind='stable') if counts[i] >= min_count]
+        if max_size > 0:
+            kept = kept[:max(max_size - 3, 0)]
+
+        unk_id = 2
+        mapping = np.full(len(self.vocab), unk_id, dtype=np.int32)
+        mapping[special] = [0, 1]
+        mapping[kept] = np.arange(3, len(kept) + 3)
+
+        # Map the token array in chunks, directly to a memory-mapped file
+        tokens = np.lib.format.open_memmap(prefix + '.tokens.npy', mode='w+', dtype=np.int32, shape=self.tokens.shape)
+        for start in range(0, len(self.tokens), CHUNK_SIZE):
+            tokens[start:start + CHUNK_SIZE] = mapping[self.tokens[start:start + CHUNK_SIZE]]
+
+        tokens.flush()
+        del tokens
+
+        # Saved last, so that its modification time marks a complete file
+        with codecs.open(prefix + '.vocab', 'w', 'utf-8') as f_out:
+            for w in [START, END, UNK] + [self.vocab[i] for i in kept]:
+                f_out.write(w + '\n')
+
+    def sentences(self):
+        """
+        Returns all the sentences, as slices (views) of the token array
+        :return: a list of arrays of word IDs
+        """
+        return [self.tokens[start:end] for start, end in zip(self.offsets, self.offsets[1:])]
+
+
+class NegativeSampler:
+    """
+    Samples the output words for a sampled softmax: the target words of the batch, and words sampled
+    from the unigram distribution raised to the power of 0.75 (shared by all the sentences in the batch)
+    """
+    def __init__(self, word_counts, num_sampled, power=0.75):
+        """
+        Initializes the sampler.
+        :param word_counts: the number of occurrences of each word
+        :param num_sampled: the number of sampled words in each step
+        :param power: the power of the unigram distribution
+        """
+        self.num_sampled = num_sampled
+        self.probs = np.power(np.maximum(word_counts, 1), power)
+        self.probs /= self.probs.sum()
+
+    def sample(self, targets):
+        """
+        Samples the output words for a time step
+        :param targets: the target word ID of each sentence in the batch
+        :return: the output word IDs, the logit correction (-log of their expected count) of each output word,
+        and the position of each target in the output words
+        """
+        negatives = np.random.choice(len(self.probs), self.num_sampled, p=self.probs)
+        candidates, positions = np.unique(np.concatenate([targets, negatives]), return_inverse=True)
+        correction = -np.log(self.num_sampled * self.probs[candidates])
+        return [int(c) for c in candidates], correction, [int(p) for p in positions[:len(targets)]]
+
+
+def make_batches(sents, batch_size):
+    """
+    Groups sentences of similar lengths into minibatches, to minimize padding
+    :param sents: a list of sentences (lists or arrays of word IDs)
+    :param batch_size: the number of sentences in each batch
+    :return: a list of batches, in random order, each sorted by decreasing sentence length
+    """
+    # Sort by length, breaking ties randomly, so that each epoch has different batches
+    order = sorted(range(len(sents)), key=lambda i: (len(sents[i]), random.random()), reverse=True)
+    batches = [[sents[i] for i in order[start:start + batch_size]] for start in range(0, len(order), batch_size)]
+    random.shuffle(batches)
+    return batches
+
+
 class RNNLanguageModel:
     """
     An RNN Language Model
@@ -196,6 +445,7 @@ class RNNLanguageModel:
 
         self.R = model.add_parameters((vocab_size, hidden_dim))
         self.bias = model.add_parameters((vocab_size))
+        self.state_cache = OrderedDict()
 
     def save_to_disk(self, filename):
         """
@@ -208,6 +458,54 @@ class RNNLanguageModel:
         Loads the language model from the disk
         """
         self.model.populate(filename)
+        self.clear_state_cache()
+
+    def export_to_numpy(self, filename, vocab=None):
+        """
+        Saves the lookup table, LSTM weights, R and bias to a single .npz file, for inference with
+        NumpyLanguageModel (without DyNet). Verifies that the NumPy model reproduces the distributions.
+        :param filename: the output file
+        :param vocab: optional - the Vocab object, saved to decode the word IDs
+        """
+        weights = {'lookup': self.lookup.as_array(), 'R': self.R.as_array(), 'bias': self.bias.as_array()}
+        layers = self.builder.get_parameters()
+
+        if any(len(layer) != 3 for layer in layers):
+            raise ValueError('Only (vanilla) LSTM builders can be exported')
+
+        weights['num_layers'] = len(layers)
+        for i, (Wx, Wh, b) in enumerate(layers):
+            weights['Wx_{}'.format(i)], weights['Wh_{}'.format(i)], weights['b_{}'.format(i)] = \
+                Wx.as_array(), Wh.as_array(), b.as_array()
+
+        if vocab is not None:
+            weights['vocab'] = np.array([vocab.i2w[i] for i in range(vocab.size())])
+
+        # Depending on the DyNet version, the LSTM adds a constant forget gate bias on the fly: keep the value
+        # that reproduces the DyNet log-probabilities best (the probabilities are too small to compare directly)
+        vocab_size = len(weights['bias'])
+        probe = [(7 * i + 1) % vocab_size for i in range(PROBE_LENGTH)]
+        expected = np.log(self.predict_next_word(probe).npvalue())
+        errors = {}
+
+        for forget_bias in [0.0, 1.0]:
+            weights['forget_bias'] = forget_bias
+            np.savez(filename, **weights)
+            errors[forget_bias] = np.abs(np.log(NumpyLanguageModel(filename).next_word_probs(probe)) - expected).max()
+
+        forget_bias = min(errors, key=errors.get)
+        if errors[forget_bias] > EXPORT_TOLERANCE:
+            raise ValueError('The exported NumPy model does not reproduce the DyNet distributions '
+                             '(maximal log-probability error: {:.2e})'.format(errors[forget_bias]))
+
+        if max(errors.values()) <= EXPORT_TOLERANCE:
+            logger.warning('Both forget gate biases reproduce the DyNet distributions on the probe sentence, '
+                           'choosing the closer one ({})'.format(forget_bias))
+
+        weights['forget_bias'] = forget_bias
+        np.savez(filename, **weights)
+        logger.info('Exported to {} (forget gate bias: {}, maximal log-probability error: {:.2e})'.format(
+            filename, forget_bias, errors[forget_bias]))
 
     def build_lm_graph(self, sent):
         dy.renew_cg()
@@ -230,66 +528,310 @@ class RNNLanguageModel:
         nerr = dy.esum(errs) if len(errs) > 0 else dy.scalarInput(0)
         return nerr
 
-    def predict_next_word(self, sentence):
+    def build_lm_graph_batch(self, sents, sampler=None):
+        """
+        Builds a single computation graph for the loss of a minibatch of sentences, using batched lookups.
+        Shorter sentences are padded, and their padding is masked out of the loss.
+        :param sents: a list of sentences (lists of word IDs), sorted by decreasing length
+        :param sampler: optional - a NegativeSampler, to compute a sampled softmax instead of the full softmax
+        :return: the sum of the losses of all the sentences, and the number of predicted words
+        """
+        errs, num_words = self._build_sentence_losses(sents, sampler)
+        return dy.sum_batches(errs), num_words
+
+    def score_sentences(self, sents, batch_size=32):
+        """
+        Computes the log-probabilities of many sentences, in batches of sentences of similar lengths
+        :param sents: a list of sentences (lists or arrays of word IDs, starting with START)
+        :param batch_size: the number of sentences in each batch
+        :return: the log-probability of each sentence (in the input order), and the corpus perplexity
+        """
+        log_probs = np.zeros(len(sents))
+        total_words = 0
+
+        order = sorted(range(len(sents)), key=lambda i: len(sents[i]), reverse=True)
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            errs, num_words = self._build_sentence_losses([sents[i] for i in indices])
+            log_probs[indices] = -errs.npvalue().reshape(-1)
+            total_words += num_words
+
+        perplexity = float(np.exp(-log_probs.sum() / max(total_words, 1)))
+        return log_probs, perplexity
+
+    def _build_sentence_losses(self, sents, sampler=None):
+        """
+        Builds the graph of the loss of each sentence in a batch (see build_lm_graph_batch)
+        :return: a batched expression with the loss of each sentence, and the number of predicted words
+        """
         dy.renew_cg()
-        init_state = self.builder.initial_state()
+        state = self.builder.initial_state()
+
         R = dy.parameter(self.R)
         bias = dy.parameter(self.bias)
-        state = init_state
-        for cw in sentence:
-            # assume word is already a word-id
-            x_t = dy.lookup(self.lookup, int(cw))
+        errs = []
+        num_words = 0
+
+        # The word IDs and masks at each time step
+        max_len = len(sents[0])
+        wids = [[int(sent[i]) if i < len(sent) else int(sent[-1]) for sent in sents] for i in range(max_len)]
+        masks = [[1.0 if i < len(sent) else 0.0 for sent in sents] for i in range(max_len)]
+
+        for cwids, nwids, mask in zip(wids, wids[1:], masks[1:]):
+            x_t = dy.lookup_batch(self.lookup, cwids)
             state = state.add_input(x_t)
-        y_t = state.output()
-        r_t = bias + (R * y_t)
-        prob = dy.softmax(r_t)
-        return prob
+            y_t = state.output()
+
+            if sampler is not None:
+                candidates, correction, positions = sampler.sample(nwids)
+                r_t = dy.affine_transform([dy.select_rows(bias, candidates) + dy.inputVector(correction),
+                                           dy.select_rows(R, candidates), y_t])
+                err = dy.pickneglogsoftmax_batch(r_t, positions)
+            else:
+                r_t = dy.affine_transform([bias, R, y_t])
+                err = dy.pickneglogsoftmax_batch(r_t, nwids)
+
+            if min(mask) == 0:
+                err = err * dy.reshape(dy.inputVector(mask), (1,), batch_size=len(sents))
+
+            errs.append(err)
+            num_words += int(sum(mask))
+
+        nerr = dy.esum(errs) if len(errs) > 0 else dy.scalarInput(0)
+        return nerr, num_words
+
+    def predict_next_word(self, sentence):
+        """
+        Returns the distribution of the next word after the sentence. The LSTM state of the
+        longest cached prefix of the sentence is reused, so consecutive calls on a growing sentence
+        only run the LSTM over the new words.
+        :param sentence: a list of word IDs
+        :return: a Dynet expression of the next word probabilities
+        """
+        probs = self.get_state(sentence).next_word_probs()
+        return dy.inputVector(probs)
+
+    def get_state(self, prefix):
+        """
+        Returns the generation state after reading the prefix, extending the longest cached prefix
+        :param prefix: a non-empty list of word IDs
+        :return: a GenerationState
+        """
+        prefix = tuple(int(w) for w in prefix)
+
+        # Find the longest cached prefix
+        length = len(prefix)
+        while length > 0 and prefix[:length] not in self.state_cache:
+            length -= 1
+
+        state = self.state_cache[prefix[:length]] if length > 0 else None
+        if state is not None:
+            self.state_cache.move_to_end(prefix[:length])
+
+        for w in prefix[length:]:
+            state = self.extend_states([state], [w])[0]
+
+        return state
+
+    def extend_state(self, state, word):
+        """
+        Extends a generation state by one word. The state itself is not changed, so a state
+        can be extended several times with different words (e.g. for beam search).
+        :param state: a GenerationState, or None for the initial state
+        :param word: the next word ID
+        :return: the new GenerationState
+        """
+        return self.extend_states([state], [word])[0]
+
+    def extend_states(self, states, words):
+        """
+        Extends several generation states by one word each, in a single batched graph
+        :param states: a list of GenerationState objects (or None for the initial state)
+        :param words: the next word ID of each state
+        :return: a list of the new GenerationState objects
+        """
+        dy.renew_cg()
+        batch_size = len(states)
+        R = dy.parameter(self.R)
+        bias = dy.parameter(self.bias)
 
-    def sample(self, first=1, nwords=0, stop=-1):
-        res = [first]
+        if all(state is None for state in states):
+            state = self.builder.initial_state()
+        else:
+            # Start from the saved vectors of each state (zeros for initial states)
+            template = next(state for state in states if state is not None).vectors
+            vectors = [np.stack([state.vectors[i] if state is not None else np.zeros_like(v) for state in states],
+                                axis=-1)
+                       for i, v in enumerate(template)]
+            state = self.builder.initial_state([dy.inputTensor(v, batched=True) for v in vectors])
+
+        state = state.add_input(dy.lookup_batch(self.lookup, [int(w) for w in words]))
+        r_t = dy.affine_transform([bias, R, state.output()])
+
+        logits = r_t.npvalue().reshape(-1, batch_size).astype(np.float32)
+        vectors = [e.npvalue().reshape(-1, batch_size) for e in state.s()]
+
+        new_states = []
+        for b, (prev, w) in enumerate(zip(states, words)):
+            prefix = (prev.prefix if prev is not None else ()) + (int(w),)
+            new_state = GenerationState(prefix, [v[:, b].copy() for v in vectors], logits[:, b].copy())
+            self.cache_state(new_state)
+            new_states.append(new_state)
+
+        return new_states
+
+    def cache_state(self, state):
+        """
+        Adds a generation state to the cache, evicting the least recently used state if the cache is full
+        """
+        self.state_cache[state.prefix] = state
+        self.state_cache.move_to_end(state.prefix)
+
+        if len(self.state_cache) > MAX_CACHED_STATES:
+            self.state_cache.popitem(last=False)
+
+    def clear_state_cache(self):
+        """
+        Clears the cached generation states. Must be called after the parameters are updated.
+        """
+        self.state_cache.clear()
+
+    def beam_search(self, prefix, beam_size=5, nwords=10, stop=-1):
+        """
+        Returns the most probable continuations of the prefix, extending all the beam states in a single graph
+        :param prefix: a non-empty list of word IDs
+        :param beam_size: the number of continuations to keep in each step
+        :param nwords: the maximal number of words to add
+        :param stop: the word ID that ends a continuation
+        :return: a list of (list of word IDs, log probability) tuples, from the most probable
+        """
+        beam = [(self.get_state(prefix), 0.0)]
+        finished = []
+
+        for _ in range(nwords):
+            candidates = []
+            for state, score in beam:
+                log_probs = state.next_word_log_probs()
+                for w in np.argsort(-log_probs)[:beam_size]:
+                    candidates.append((score + float(log_probs[w]), state, int(w)))
+
+            candidates = sorted(candidates, key=lambda c: -c[0])[:beam_size]
+            new_states = self.extend_states([state for _, state, _ in candidates], [w for _, _, w in candidates])
+            beam = []
+            for (score, _, w), new_state in zip(candidates, new_states):
+                if w == stop:
+                    finished.append((list(new_state.prefix), score))
+                else:
+                    beam.append((new_state, score))
+
+            if len(beam) == 0:
+                break
+
+        finished.extend((list(state.prefix), score) for state, score in beam)
+        return sorted(finished, key=lambda c: -c[1])[:beam_size]
+
+    def sample(self, first=1, nwords=0, stop=-1, temperature=1.0, top_k=0):
+        """
+        Samples a single sequence from the language model
+        :param first: the first word ID
+        :param nwords: the maximal number of sampled words (0 for no limit)
+        :param stop: the word ID that ends the sequence
+        :param temperature: the softmax temperature (lower is more conservative)
+        :param top_k: if positive, sample only from the top_k most probable words
+        :return: the list of word IDs, starting with first
+        """
+        return self.sample_batch(1, first=first, nwords=nwords, stop=stop, temperature=temperature, top_k=top_k)[0]
+
+    def sample_batch(self, num_samples, first=1, nwords=0, stop=-1, temperature=1.0, top_k=0):
+        """
+        Samples several sequences from the language model, advancing all of them in a single graph
+        :param num_samples: the number of sequences to sample
+        :param first: the first word ID
+        :param nwords: the maximal number of sampled words (0 for no limit)
+        :param stop: the word ID that ends a sequence
+        :param temperature: the softmax temperature (lower is more conservative)
+        :param top_k: if positive, sample only from the top_k most probable words
+        :return: a list of num_samples lists of word IDs, each starting with first
+        """
+        res = [[first] for _ in range(num_samples)]
+        done = [False] * num_samples
         dy.renew_cg()
         state = self.builder.initial_state()
 
         R = dy.parameter(self.R)
         bias = dy.parameter(self.bias)
-        cw = first
+        cws = [first] * num_samples
         while True:
-            x_t = dy.lookup(self.lookup, cw)
+            x_t = dy.lookup_batch(self.lookup, cws)
             state = state.add_input(x_t)
             y_t = state.output()
-            r_t = bias + (R * y_t)
-            ydist = dy.softmax(r_t)
-            dist = ydist.vec_value()
-            rnd = random.random()
-            for i, p in enumerate(dist):
-                rnd -= p
-                if rnd <= 0: break
-            res.append(i)
-            cw = i
-            if cw == stop: break
-            if nwords and len(res) > nwords: break
+            r_t = dy.affine_transform([bias, R, y_t])
+            logits = r_t.npvalue().reshape(-1, num_samples)
+            cws = sample_from_logits(logits, temperature=temperature, top_k=top_k)
+
+            for b, cw in enumerate(cws):
+                if not done[b]:
+                    res[b].append(cw)
+                    done[b] = cw == stop or (nwords and len(res[b]) > nwords)
+
+            if all(done):
+                break
+
         return res
 
 
+class GenerationState:
+    """
+    An opaque handle to the LSTM state after reading a prefix, and the scores of the next word
+    """
+    def __init__(self, prefix, vectors, logits):
+        self.prefix = prefix
+        self.vectors = vectors
+        self.logits = logits
+
+    def next_word_log_probs(self):
+        """
+        Returns the log probabilities of the next word
+        :return: a numpy array of vocabulary size
+        """
+        logits = self.logits - self.logits.max()
+        return logits - np.log(np.exp(logits).sum())
+
+    def next_word_probs(self):
+        """
+        Returns the probabilities of the next word
+        :return: a numpy array of vocabulary size
+        """
+        return np.exp(self.next_word_log_probs())
+
+
 def load_text_embeddings(embeddings_file, dim, vocabulary):
     """
-    Load textual word embeddings (e.g. pretrained GloVe)
+    Load textual word embeddings (e.g. pretrained GloVe). The file is streamed, and only
+    the vectors of words in the vocabulary are parsed, so the memory is proportional to the vocabulary size.
     :param embeddings_file: the embedding file in textual format
     :param dim: the embeddings dimension
     :param vocabulary: the specific words to load
-    :return: the word vectors
+    :return: the word vectors, in the order of the vocabulary
     """
+    word_index = {word: i for i, word in enumerate(vocabulary)}
+    wv = np.empty((len(word_index), dim))
+    found = np.zeros(len(word_index), dtype=bool)
+
     with codecs.open(embeddings_file, 'r', 'utf-8') as f_in:
-        lines = [line.strip().split(' ', 1) for line in f_in]
-        lines = [line for line in lines if len(line) == 2]
+        for line in f_in:
+            line = line.strip().split(' ', 1)
+            if len(line) != 2 or line[0] not in word_index:
+                continue
 
-    vectors = { word : np.fromstring(vector, sep=' ') for (word, vector) in lines if len(vector.split()) == dim }
+            vector = np.fromstring(line[1], sep=' ')
+            if len(vector) == dim:
+                index = word_index[line[0]]
+                wv[index] = vector
+                found[index] = True
 
     # Add a random vector for each OOV word
-    unknown_words = set(vocabulary).difference(set(vectors.keys()))
-    vectors.update({ word : np.random.random_sample((1, dim)) for word in unknown_words})
-
-    wv = np.vstack([vectors[word] for word in vocabulary])
+    wv[~found] = np.random.random_sample(((~found).sum(), dim))
     return wv
 
 
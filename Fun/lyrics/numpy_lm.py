@@ -0,0 +1,165 @@
+import logging
+
+import numpy as np
+
+from docopt import docopt
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def main():
+    args = docopt("""Samples a text (in the form of a song) from a language model exported by lyrics_lm.py,
+        without loading DyNet.
+
+        Usage:
+            numpy_lm.py [--num_samples=<n>] [--nwords=<n>] [--temperature=<t>] [--top_k=<k>] <model_file>
+
+            Arguments:
+                model_file          the exported model file (<model_name>.npz).
+
+        Options:
+            --num_samples=<n>   the number of sentences to sample [default: 25].
+            --nwords=<n>        the maximal number of words in each sentence [default: 10].
+            --temperature=<t>   the softmax temperature [default: 1.0].
+            --top_k=<k>         sample only from the k most probable words (0 for all the words) [default: 0].
+        """)
+    lm = NumpyLanguageModel(args['<model_file>'])
+    start_index, end_index = lm.w2i['<s>'], lm.w2i['</s>']
+
+    samples = lm.sample_batch(int(args['--num_samples']), first=start_index, stop=end_index,
+                              nwords=int(args['--nwords']), temperature=float(args['--temperature']),
+                              top_k=int(args['--top_k']))
+
+    for i, sample in enumerate(samples):
+        print(' '.join([lm.i2w[w] for w in sample if w != start_index and w != end_index]).strip())
+
+        # Line break every five sentences (to simulate songs)
+        if i % 5 == 0 and i > 0:
+            print('\n')
+
+
+class NumpyLanguageModel:
+    """
+    A NumPy implementation of the forward pass of RNNLanguageModel (with an LSTM builder),
+    loaded from the file created by RNNLanguageModel.export_to_numpy
+    """
+    def __init__(self, filename):
+        with np.load(filename) as data:
+            self.lookup = data['lookup']
+            self.R = data['R']
+            self.bias = data['bias']
+            self.forget_bias = float(data['forget_bias'])
+            num_layers = int(data['num_layers'])
+            self.layers = [(data['Wx_{}'.format(i)], data['Wh_{}'.format(i)], data['b_{}'.format(i)])
+                           for i in range(num_layers)]
+            self.i2w = list(data['vocab']) if 'vocab' in data else None
+
+        self.w2i = {w: i for i, w in enumerate(self.i2w)} if self.i2w is not None else None
+        self.hidden_dim = self.layers[0][1].shape[1]
+
+    def initial_state(self, batch_size=1):
+        """
+        Returns the initial LSTM state
+        :param batch_size: the number of sequences
+        :return: a list of (c, h) tuples, one for each layer, each hidden_dim x batch_size
+        """
+        return [(np.zeros((self.hidden_dim, batch_size)), np.zeros((self.hidden_dim, batch_size)))
+                for _ in self.layers]
+
+    def step(self, state, words):
+        """
+        Feeds one word to each sequence
+        :param state: the current LSTM state (see initial_state)
+        :param words: the word ID of each sequence
+        :return: the new state and the next word scores (vocab_size x batch_size)
+        """
+        x, new_state = self.lookup[words].T, []
+        hidden = self.hidden_dim
+
+        for (Wx, Wh, b), (c, h) in zip(self.layers, state):
+            gates = Wx.dot(x) + Wh.dot(h) + b[:, None]
+            i = sigmoid(gates[:hidden])
+            f = sigmoid(gates[hidden:2 * hidden] + self.forget_bias)
+            o = sigmoid(gates[2 * hidden:3 * hidden])
+            g = np.tanh(gates[3 * hidden:])
+            c = f * c + i * g
+            h = o * np.tanh(c)
+            new_state.append((c, h))
+            x = h
+
+        return new_state, self.R.dot(x) + self.bias[:, None]
+
+    def next_word_probs(self, sentence):
+        """
+        Returns the distribution of the next word after the sentence
+        :param sentence: a list of word IDs
+        :return: a numpy array of the next word probabilities
+        """
+        state = self.initial_state()
+        for w in sentence:
+            state, logits = self.step(state, [w])
+
+        return softmax(logits[:, 0])
+
+    def sample_batch(self, num_samples, first=1, nwords=0, stop=-1, temperature=1.0, top_k=0):
+        """
+        Samples several sequences from the language model
+        :param num_samples: the number of sequences to sample
+        :param first: the first word ID
+        :param nwords: the maximal number of sampled words (0 for no limit)
+        :param stop: the word ID that ends a sequence
+        :param temperature: the softmax temperature (lower is more conservative)
+        :param top_k: if positive, sample only from the top_k most probable words
+        :return: a list of num_samples lists of word IDs, each starting with first
+        """
+        res = [[first] for _ in range(num_samples)]
+        done = [False] * num_samples
+        state = self.initial_state(num_samples)
+        cws = [first] * num_samples
+
+        while not all(done):
+            state, logits = self.step(state, cws)
+            cws = sample_from_logits(logits, temperature=temperature, top_k=top_k)
+
+            for b, cw in enumerate(cws):
+                if not done[b]:
+                    res[b].append(cw)
+                    done[b] = cw == stop or (nwords and len(res[b]) > nwords)
+
+        return res
+
+
+def sigmoid(x):
+    return 0.5 * (np.tanh(0.5 * x) + 1.0)
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max())
+    return exp / exp.sum()
+
+
+def sample_from_logits(logits, temperature=1.0, top_k=0):
+    """
+    Samples a word for each column of the logits matrix, using a cumulative sum of the probabilities
+    :param logits: a numpy array of scores, vocab_size x batch_size
+    :param temperature: the softmax temperature (lower is more conservative)
+    :param top_k: if positive, sample only from the top_k highest scoring words
+    :return: a list of batch_size sampled word IDs
+    """
+    logits = logits / temperature
+
+    if 0 < top_k < logits.shape[0]:
+        kth_best = np.partition(logits, -top_k, axis=0)[-top_k]
+        logits = np.where(logits >= kth_best, logits, -np.inf)
+
+    cdf = np.cumsum(np.exp(logits - logits.max(axis=0)), axis=0)
+    rnd = np.random.random(logits.shape[1]) * cdf[-1]
+
+    # The first index in which the cumulative probability exceeds the random number
+    sampled = np.minimum((cdf <= rnd).sum(axis=0), logits.shape[0] - 1)
+    return [int(i) for i in sampled]
+
+
+if __name__ == '__main__':
+    main()
@@ -30,7 +30,7 @@ logger.setLevel(logging.DEBUG)
 from bibtexparser.bparser import BibTexParser
 from bibtexparser.customization import convert_to_unicode
 
-from common import get_from_pdf, normalize_title, process_acl_anthology_file, extract_authors
+from common import get_from_pdf, normalize_title, load_acl_anthology, load_title_index, extract_authors
 
 
 def main():
@@ -53,17 +53,19 @@ def main():
                     f_out.write(data)
 
             logger.info('Reading ACL anthology bib file')
-            acl_anthology_by_id, acl_anthology_by_title = process_acl_anthology_file(filename=acl_anthology_file,
-                                                                                     show_progress=False)
+            acl_anthology_by_id, acl_anthology_by_title = load_acl_anthology(filename=acl_anthology_file,
+                                                                             show_progress=False)
             logger.info('Read {} entries'.format(len(acl_anthology_by_id)))
 
-            result = get_from_pdf(args.in_file, acl_anthology_by_title)
+            title_index = load_title_index(acl_anthology_by_title, filename=acl_anthology_file)
+            result = get_from_pdf(args.in_file, acl_anthology_by_title, title_index)
 
             if result is None:
                 logger.error('Sorry, I could not get the bib info for this paper.')
                 easygui.msgbox('Sorry, I could not get the bib info for this paper.', title='Error')
             else:
-                bib_entry, title = result
+                bib_entry, title, confidence = result
+                logger.info('Matched the title with confidence {:.2f}'.format(confidence))
                 add_to_reading_list(reading_list, bib_entry, title)
                 easygui.msgbox('Successfully added the following paper to the reading list: "{}"'.format(title),
                                title='Success')
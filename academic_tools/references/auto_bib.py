@@ -13,6 +13,12 @@ ap.add_argument('--in_file', help='a local file containing links to papers')
 ap.add_argument('--acl_anthology_file', help='A single .bib file containing most of the records in the ACL Anthology',
                 default='http://aclanthology.info/anthology.bib')
 ap.add_argument('--out_bib_file', help='Where to save the output (bib file)', default='references.bib')
+ap.add_argument('--threads', help='the number of links resolved concurrently', type=int, default=8)
+ap.add_argument('--max_per_host', help='the maximal number of concurrent requests to each website', type=int, default=2)
+ap.add_argument('--delay', help='the minimal number of seconds between requests to each website',
+                type=float, default=1.0)
+ap.add_argument('--retries', help='the maximal number of retries of a failed request', type=int, default=3)
+ap.add_argument('--retry_budget', help='the maximal number of retries of all the requests', type=int, default=50)
 args = ap.parse_args()
 
 # Log
@@ -27,12 +33,17 @@ import json
 import tqdm
 import urllib
 import codecs
+import tempfile
 
 from bs4 import BeautifulSoup
 from arxiv2bib import arxiv2bib
 from urllib.parse import urljoin
 
-from common import get_from_pdf, normalize_title, process_acl_anthology_file
+from polite_fetcher import PoliteFetcher, map_concurrently
+from common import get_from_pdf, normalize_title, load_acl_anthology, load_title_index
+
+fetcher = PoliteFetcher(max_per_host=args.max_per_host, delay=args.delay, retries=args.retries,
+                        retry_budget=args.retry_budget)
 
 
 def main():
@@ -47,13 +58,14 @@ def main():
             f_out.write(data)
 
     logger.info('Reading ACL anthology bib file')
-    acl_anthology_by_id, acl_anthology_by_title = process_acl_anthology_file()
+    acl_anthology_by_id, acl_anthology_by_title = load_acl_anthology()
     logger.info('Read {} entries'.format(len(acl_anthology_by_id)))
+    title_index = load_title_index(acl_anthology_by_title)
 
     # Read the references
     if args.in_url:
         logger.info('Reading references from {}'.format(args.in_url))
-        page = urllib.request.urlopen(args.in_url)
+        page = fetcher.fetch(args.in_url)
         soup = BeautifulSoup(page, 'html.parser')
         links = filter(None, [link.get('href') for link in soup.findAll('a')])
 
@@ -65,14 +77,18 @@ def main():
         with codecs.open(args.in_file, 'r', 'utf-8') as f_in:
             links = [line.strip() for line in f_in]
 
-    links = list(set(links))
+    # Remove duplicate links, keeping the order of the page, so that the output is deterministic
+    links = list(dict.fromkeys(links))
     logger.info('Found {} links'.format(len(links)))
 
+    # Resolve the links concurrently (the fetcher limits the requests to each website)
+    results = map_concurrently(lambda link: try_get_bib(link, acl_anthology_by_id, acl_anthology_by_title, title_index),
+                               links, threads=args.threads)
+
     # Save references as a dictionary with the normalized title as a key,
     # to prevent duplicate entries (i.e. especially from bib and paper links)
     references = {}
-    for link in links:
-        result = try_get_bib(link, acl_anthology_by_id, acl_anthology_by_title)
+    for result in results:
         if result is not None:
             bib, title = result
             references[title] = bib
@@ -83,13 +99,14 @@ def main():
             f_out.write(bib + '\n\n')
 
 
-def try_get_bib(url, acl_anthology_by_id, acl_anthology_by_title):
+def try_get_bib(url, acl_anthology_by_id, acl_anthology_by_title, title_index=None):
     """
     Gets a URL to a publication and tries to extract a bib entry for it
     Returns None if it fails (e.g. if it's not a publication)
     :param url: the URL to extract a publication from
     :param acl_anthology_by_id: a dictionary of publications by ID (from ACL anthology)
     :param acl_anthology_by_title: a dictionary of publications by title (from ACL anthology)
+    :param title_index: an approximate-match index of the ACL anthology titles, for papers read from pdf
     :return: a tuple of (bib entry, tuple) or None if not found / error occurred
     """
     lowercased_url = url.lower()
@@ -101,7 +118,7 @@ def try_get_bib(url, acl_anthology_by_id, acl_anthology_by_title):
 
     # If ends with bib, read it
     if filename.endswith('.bib'):
-        bib_entry = urllib.request.urlopen(url).read().decode('utf-8')
+        bib_entry = fetcher.fetch(url).decode('utf-8')
         title = get_title_from_bib_entry(bib_entry)
         return (bib_entry, title)
 
@@ -122,7 +139,8 @@ def try_get_bib(url, acl_anthology_by_id, acl_anthology_by_title):
 
     # If arXiv URL, get paper details from arXiv
     if 'arxiv.org' in lowercased_url:
-        results = arxiv2bib([paper_id])
+        with fetcher.host_slot('export.arxiv.org'):
+            results = arxiv2bib([paper_id])
 
         if len(results) > 0:
             try:
@@ -174,15 +192,18 @@ def try_get_bib(url, acl_anthology_by_id, acl_anthology_by_title):
     # Else: try to read the pdf and find it in the acl anthology by the title
     if lowercased_url.endswith('pdf'):
 
-        # Download the file to a temporary file
-        data = urllib.request.urlopen(url).read()
-        with open('temp.pdf', 'wb') as f_out:
+        # Download the file to a temporary file (a different file in each thread)
+        data = fetcher.fetch(url)
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f_out:
             f_out.write(data)
 
-        result = get_from_pdf('temp.pdf', acl_anthology_by_title)
+        try:
+            result = get_from_pdf(f_out.name, acl_anthology_by_title, title_index)
+        finally:
+            os.remove(f_out.name)
 
         if result is not None:
-            bib_entry, title = result
+            bib_entry, title, _ = result
             title = normalize_title(title)
             return (bib_entry, title)
 
@@ -200,7 +221,7 @@ def get_bib_from_tacl(paper_id):
     url = 'https://transacl.org/ojs/index.php/tacl/rt/captureCite/{id}/0/BibtexCitationPlugin'.format(id=paper_id)
 
     try:
-        page = urllib.request.urlopen(url)
+        page = fetcher.fetch(url)
         soup = BeautifulSoup(page, 'html.parser')
         bib_entry = soup.find('pre').string
         title = soup.find('h3').string
@@ -218,7 +239,7 @@ def get_bib_from_semantic_scholar(url):
     :return: a tuple of (bib entry, title) or None if not found / error occurred
     """
     try:
-        page = urllib.request.urlopen(url)
+        page = fetcher.fetch(url)
         soup = BeautifulSoup(page, 'html.parser')
 
         # Get the JSON paper info
@@ -1,8 +1,22 @@
+import os
 import re
+import mmap
 import tqdm
+import pickle
 import urllib
-import codecs
 import textract
+import subprocess
+import unicodedata
+
+from array import array
+from title_index import TitleIndex
+
+# BibTeX entry types that don't describe a publication
+NON_PUBLICATION_ENTRY_TYPES = {'string', 'comment', 'preamble'}
+
+# The version of the saved index files: increase it when the index contents change
+# (e.g. the keys, normalize_title or TitleIndex), so that the existing index files are rebuilt
+INDEX_FORMAT_VERSION = 2
 
 
 def normalize_title(title):
@@ -11,83 +25,257 @@ def normalize_title(title):
     :param title: the original paper title
     :return: the normalized title
     """
-    return re.sub('\s+', ' ', re.sub('[\W_]+', ' ', title.lower()))
+    return re.sub('\s+', ' ', re.sub('[\W_]+', ' ', title.lower())).strip()
 
 
-def get_from_pdf(filename, acl_anthology_by_title):
+def get_from_pdf(filename, acl_anthology_by_title, title_index=None, num_lines=5, min_confidence=0.6):
     """
-    Reads a paper from a pdf, extracts its title and searches for it in the ACL anthology
+    Reads a paper from a pdf, extracts its title and searches for it in the ACL anthology.
+    The title is searched in the first few lines of the text, and in pairs and triplets of consecutive lines
+    (for titles that are wrapped or have a subtitle). If there is no exact match and a title index is given,
+    the most similar title is returned.
     :param filename: the pdf file name
     :param acl_anthology_by_title: a dictionary of paper titles to bib entries
-    :return: the bib entry or None if not found / error occurred
+    :param title_index: an approximate-match index of the titles (see load_title_index), or None for exact matches only
+    :param num_lines: the number of lines in the beginning of the text that may contain the title
+    :param min_confidence: the minimal similarity of an approximate match
+    :return: a tuple of the bib entry, the title and the confidence (1.0 for an exact match),
+    or None if not found / error occurred
     """
     try:
-        # Get the "title" - first line in the file
-        text = textract.process(filename).decode('utf-8')
+        # Replace ligatures (e.g. "ﬁ") with the separate letters
+        text = unicodedata.normalize('NFKC', extract_first_page_text(filename))
+    except:
+        return None
+
+    # Get the "title" candidates - the first non-empty lines in the file
+    lines = [line.strip() for line in text.split('\n') if len(normalize_title(line)) > 0][:num_lines]
+    candidates = [' '.join(lines[i:i + length]) for length in [1, 2, 3] for i in range(len(lines) - length + 1)]
 
-        # Search for it in the ACL anthology
-        title = text.split('\n')[0]
+    # Search for it in the ACL anthology
+    for title in candidates:
         bib_entry = acl_anthology_by_title.get(normalize_title(title), None)
-    except:
+
+        if bib_entry is not None:
+            return (bib_entry, title, 1.0)
+
+    if title_index is None:
         return None
 
-    if bib_entry is not None:
-        return (bib_entry, title)
+    best_match = max([title_index.search(normalize_title(title)) + (title,) for title in candidates],
+                     key=lambda match: match[1], default=(None, 0.0, None))
+    matched_title, confidence, title = best_match
+
+    if confidence >= min_confidence:
+        return (acl_anthology_by_title[matched_title], title, confidence)
 
     else:
         return None
 
 
-def process_acl_anthology_file(filename='anthology.bib', show_progress=True):
+def extract_first_page_text(filename, max_chars=4096):
     """
-    Reads the single ACL anthology bib entries file and saves it as
-    a dictionary of title -> bib entry. Titles are lower-cased and trimmed (e.g.
-    only a single space separates each word), and punctuation is removed
-    (to normalize and facilitate the search).
-    :return: a dictionary of bib entries by ID and by title
+    Extracts the text in the beginning of a pdf, which contains the title, without extracting the entire paper.
+    Only the first page is read with pdftotext (which textract uses for pdf files), and if it fails
+    or the first page has no text (e.g. a scanned paper), the text is extracted from the entire file with textract.
+    :param filename: the pdf file name
+    :param max_chars: the maximal number of characters to return
+    :return: the text in the beginning of the file
     """
-    entries_by_id, entries_by_title = {}, {}
-    title_pattern = re.compile('\s*title\s*=\s*"([^"]+)"')
-    entry_pattern = re.compile('\s*@InProceedings{([^,]+),')
-    entry = []
-    id, normalized_title = None, None
+    try:
+        text = subprocess.run(['pdftotext', '-f', '1', '-l', '1', filename, '-'], check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode('utf-8', errors='replace')
+    except (OSError, subprocess.SubprocessError):
+        text = ''
 
-    with codecs.open(filename, 'r', 'utf-8') as f_in:
-        lines = tqdm.tqdm(f_in) if show_progress else f_in
-        for line in lines:
-            line = line.strip()
+    if len(text.strip()) == 0:
+        text = textract.process(filename).decode('utf-8')
 
-            match = entry_pattern.match(line)
+    return text[:max_chars]
 
-            # Beginning of bib entry
-            if match:
-                entry = [line]
-                normalized_title = None
-                id = match.group(1).upper()
 
-            # End of bib entry
-            elif line == '}':
-                entry.append('}')
-                entry_text = '\n'.join(entry)
+def index_bib_file(filename='anthology.bib', show_progress=True):
+    """
+    Reads a bib file in a single streaming pass, and indexes the location of each entry (of any type)
+    in the file, without keeping the entries themselves in memory.
+    Titles are lower-cased and trimmed (e.g. only a single space separates each word),
+    and punctuation is removed (to normalize and facilitate the search).
+    :return: a dictionary of entry ID -> entry number, a dictionary of normalized title -> entry number,
+    and the byte offset and length of each entry in the file
+    """
+    ids, titles = {}, {}
+    offsets, lengths = array('q'), array('q')
+    title_pattern = re.compile('\s*title\s*=\s*(.+)', re.IGNORECASE)
+    entry_pattern = re.compile('\s*@\s*(\w+)\s*{\s*([^,\s]+)\s*,')
+    id, normalized_title, start, depth = None, None, None, 0
+    offset = 0
 
-                if normalized_title is not None:
-                    entries_by_title[normalized_title] = entry_text
+    with open(filename, 'rb') as f_in:
+        lines = tqdm.tqdm(f_in) if show_progress else f_in
+        for raw_line in lines:
+            line = raw_line.decode('utf-8', errors='replace')
+            line_start, offset = offset, offset + len(raw_line)
 
-                if id is not None:
-                    entries_by_id[id] = entry_text
+            # Beginning of bib entry
+            if start is None:
+                match = entry_pattern.match(line)
 
-                entry, normalized_title, id = [], None, None
+                if match and match.group(1).lower() not in NON_PUBLICATION_ENTRY_TYPES:
+                    id, normalized_title, start, depth = match.group(2).upper(), None, line_start, 0
+                else:
+                    continue
 
-            else:
+            # Title
+            elif normalized_title is None:
                 match = title_pattern.match(line)
-
-                # Title
                 if match:
                     normalized_title = normalize_title(match.group(1))
 
-                entry.append(line)
+            # End of bib entry: the braces opened by the entry are closed
+            depth += line.count('{') - line.count('}')
+            if depth <= 0:
+                if normalized_title:
+                    titles[normalized_title] = len(offsets)
+
+                ids[id] = len(offsets)
+                offsets.append(start)
+                lengths.append(offset - start)
+                id, normalized_title, start = None, None, None
+
+    return ids, titles, offsets, lengths
+
+
+def process_acl_anthology_file(filename='anthology.bib', show_progress=True):
+    """
+    Reads the single ACL anthology bib entries file and indexes it by ID and by normalized title
+    (see index_bib_file). The entries are only read from the file when they are accessed.
+    :return: a dictionary-like object of bib entries by ID and by title
+    """
+    ids, titles, offsets, lengths = index_bib_file(filename=filename, show_progress=show_progress)
+    return BibEntries(filename, ids, offsets, lengths), BibEntries(filename, titles, offsets, lengths)
+
+
+class BibEntries:
+    """
+    A read-only dictionary of keys (IDs or titles) to bib entries, which reads each entry
+    from the bib file (using mmap) only when it is accessed
+    """
+    def __init__(self, filename, keys, offsets, lengths):
+        self.filename = filename
+        self.keys_to_entries = keys
+        self.offsets = offsets
+        self.lengths = lengths
+        self.bib_file = None
+
+    def __len__(self):
+        return len(self.keys_to_entries)
+
+    def __contains__(self, key):
+        return key in self.keys_to_entries
+
+    def __getitem__(self, key):
+        entry = self.keys_to_entries[key]
+
+        if self.bib_file is None:
+            with open(self.filename, 'rb') as f_in:
+                self.bib_file = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+
+        start = self.offsets[entry]
+        return self.bib_file[start:start + self.lengths[entry]].decode('utf-8', errors='replace').strip()
+
+    def get(self, key, default=None):
+        return self[key] if key in self.keys_to_entries else default
+
+    def keys(self):
+        return self.keys_to_entries.keys()
+
+
+def load_acl_anthology(filename='anthology.bib', show_progress=True, index_file=None):
+    """
+    Returns the ACL anthology entries by ID and by title (see process_acl_anthology_file).
+    The index is saved to a file, which is rebuilt only when the size or
+    modification time of the bib file changes, so the bib file isn't parsed on every run.
+    :param filename: the ACL anthology bib file
+    :param show_progress: whether to show a progress bar when parsing the bib file
+    :param index_file: the index file (default: the bib file name with the suffix .index.pkl)
+    :return: a dictionary-like object of bib entries by ID and by title
+    """
+    index_file = index_file or filename + '.index.pkl'
+    index = read_index_file(index_file, filename, keys=['ids', 'titles', 'offsets', 'lengths'])
+
+    if index is None:
+        ids, titles, offsets, lengths = index_bib_file(filename=filename, show_progress=show_progress)
+        index = {'ids': ids, 'titles': titles, 'offsets': offsets, 'lengths': lengths}
+        write_index_file(index_file, filename, index)
+
+    return BibEntries(filename, index['ids'], index['offsets'], index['lengths']), \
+           BibEntries(filename, index['titles'], index['offsets'], index['lengths'])
+
+
+def load_title_index(acl_anthology_by_title, filename='anthology.bib', index_file=None):
+    """
+    Returns an approximate-match index of the ACL anthology titles (see TitleIndex).
+    Like load_acl_anthology, the index is saved to a file and rebuilt only when the bib file changes.
+    :param acl_anthology_by_title: a dictionary of paper titles to bib entries
+    :param filename: the ACL anthology bib file
+    :param index_file: the index file (default: the bib file name with the suffix .titles.pkl)
+    :return: the title index
+    """
+    index_file = index_file or filename + '.titles.pkl'
+    index = read_index_file(index_file, filename, keys=['title_index'])
+
+    if index is None:
+        index = {'title_index': TitleIndex(acl_anthology_by_title.keys())}
+        write_index_file(index_file, filename, index)
+
+    return index['title_index']
+
+
+def read_index_file(index_file, filename, keys=()):
+    """
+    Reads an index saved by write_index_file
+    :param index_file: the index file
+    :param filename: the indexed file
+    :param keys: the keys that the index must contain
+    :return: the index, or None if the index file doesn't exist, is corrupted, misses any of the keys,
+    was saved in a different format (see INDEX_FORMAT_VERSION), or the indexed file changed
+    (in size or modification time) since the index was saved
+    """
+    if not os.path.exists(index_file):
+        return None
+
+    try:
+        with open(index_file, 'rb') as f_in:
+            index = pickle.load(f_in)
+
+        if index.pop('signature') == file_signature(filename) and all(key in index for key in keys):
+            return index
+    except Exception:
+        pass
+
+    return None
+
+
+def write_index_file(index_file, filename, index):
+    """
+    Saves an index of a file, with the index format version and the size and modification time of the indexed file
+    :param index_file: the index file
+    :param filename: the indexed file
+    :param index: a dictionary
+    """
+    index = dict(index, signature=file_signature(filename))
+
+    # Write to a temporary file first, so that a concurrent run never reads a partial index
+    temp_file = '{}.{}.tmp'.format(index_file, os.getpid())
+    with open(temp_file, 'wb') as f_out:
+        pickle.dump(index, f_out, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(temp_file, index_file)
+
 
-    return entries_by_id, entries_by_title
+def file_signature(filename):
+    stat = os.stat(filename)
+    return INDEX_FORMAT_VERSION, stat.st_size, stat.st_mtime
 
 
 def extract_authors(bib_entry):
@@ -0,0 +1,122 @@
+import time
+import logging
+import threading
+import contextlib
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# HTTP status codes that are worth retrying (rate limiting and server errors)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def map_concurrently(function, items, threads=8):
+    """
+    Applies a function (e.g. one that downloads a URL) to the items in a thread pool
+    :param function: the function, called with a single item
+    :param items: a list of items
+    :param threads: the number of threads
+    :return: the list of results, in the order of the items (None for the items on which the function failed)
+    """
+    def apply(item):
+        try:
+            return function(item)
+        except Exception as err:
+            logger.warning('Failed on {}: {}'.format(item, err))
+            return None
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(apply, items))
+
+
+class PoliteFetcher:
+    """
+    Downloads URLs from multiple threads without overloading any single website: at most `max_per_host`
+    concurrent requests are sent to each host, and each host gets at most one new request every `delay` seconds.
+    Failed requests (connection errors, rate limiting and server errors) are retried with an exponential backoff,
+    and all the requests share a total retry budget, so that a website that is down doesn't stall the run.
+    """
+    def __init__(self, max_per_host=2, delay=1.0, retries=3, retry_budget=50, backoff=1.0, timeout=30):
+        """
+        Initializes the fetcher.
+        :param max_per_host: the maximal number of concurrent requests to the same host
+        :param delay: the minimal number of seconds between the starts of two requests to the same host
+        :param retries: the maximal number of retries of each request
+        :param retry_budget: the maximal number of retries of all the requests together
+        :param backoff: the number of seconds to wait before the first retry (doubled in each retry)
+        :param timeout: the request timeout in seconds
+        """
+        self.max_per_host = max_per_host
+        self.delay = delay
+        self.retries = retries
+        self.retry_budget = retry_budget
+        self.backoff = backoff
+        self.timeout = timeout
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def fetch(self, url):
+        """
+        Downloads a URL
+        :param url: the URL
+        :return: the response body (bytes)
+        :raise: the last error, if the request failed and can't be retried
+        """
+        host = urllib.parse.urlsplit(url).netloc.lower()
+
+        for attempt in range(self.retries + 1):
+            try:
+                with self.host_slot(host):
+                    with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                        return response.read()
+
+            except (urllib.error.URLError, OSError) as err:
+                retriable = not isinstance(err, urllib.error.HTTPError) or err.code in RETRY_STATUS_CODES
+
+                if not retriable or attempt == self.retries or not self._take_retry():
+                    raise
+
+                logger.debug('Retrying {} after error: {}'.format(url, err))
+                time.sleep(self.backoff * 2 ** attempt)
+
+    @contextlib.contextmanager
+    def host_slot(self, host):
+        """
+        Waits until a request to the host is allowed, and holds one of the host's concurrent request slots
+        (e.g. for a request made by a third party library)
+        :param host: the host name
+        """
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = _Host(self.max_per_host)
+
+            host_state = self.hosts[host]
+
+        with host_state.slots:
+
+            # Reserve the next start time of a request to this host
+            with host_state.lock:
+                start_time = max(time.time(), host_state.next_start_time)
+                host_state.next_start_time = start_time + self.delay
+
+            time.sleep(max(start_time - time.time(), 0))
+            yield
+
+    def _take_retry(self):
+        with self.lock:
+            if self.retry_budget <= 0:
+                return False
+
+            self.retry_budget -= 1
+            return True
+
+
+class _Host:
+    def __init__(self, max_concurrent):
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.next_start_time = 0.0
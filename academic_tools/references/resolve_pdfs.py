@@ -0,0 +1,89 @@
+"""
+This script finds the bib entries of all the pdf files in a directory (e.g. a folder of downloaded papers)
+in the ACL anthology, and saves them to a bib file. The pdf files are read in parallel.
+"""
+
+# Command line arguments
+import argparse
+ap = argparse.ArgumentParser()
+ap.add_argument('pdf_dir', help='a directory of pdf files')
+ap.add_argument('--acl_anthology_file', help='A single .bib file containing most of the records in the ACL Anthology',
+                default='anthology.bib')
+ap.add_argument('--out_bib_file', help='Where to save the output (bib file)', default='references.bib')
+ap.add_argument('--processes', help='the number of processes reading the pdf files', type=int, default=4)
+ap.add_argument('--min_confidence', help='the minimal similarity of an approximate title match',
+                type=float, default=0.6)
+args = ap.parse_args()
+
+# Log
+import logging
+logging.basicConfig(level=logging.DEBUG, handlers=[logging.StreamHandler()])
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+logger.setLevel(logging.DEBUG)
+
+import os
+import tqdm
+import codecs
+
+from multiprocessing import Pool
+
+from common import get_from_pdf, load_acl_anthology, load_title_index
+
+# The ACL anthology index of each worker process
+acl_anthology_by_title, title_index = None, None
+
+
+def main():
+    filenames = sorted([os.path.join(args.pdf_dir, filename) for filename in os.listdir(args.pdf_dir)
+                        if filename.lower().endswith('.pdf')])
+    logger.info('Found {} pdf files'.format(len(filenames)))
+
+    # Build the indices once (if they don't exist), so that the worker processes only load them
+    logger.info('Reading ACL anthology bib file')
+    acl_anthology_by_id, by_title = load_acl_anthology(filename=args.acl_anthology_file)
+    load_title_index(by_title, filename=args.acl_anthology_file)
+    logger.info('Read {} entries'.format(len(acl_anthology_by_id)))
+
+    with Pool(processes=args.processes, initializer=init_worker, initargs=(args.acl_anthology_file,)) as pool:
+        results = list(tqdm.tqdm(pool.imap(resolve_pdf, filenames), total=len(filenames)))
+
+    # Write the entries in the order of the files, without duplicates
+    references, num_found = {}, 0
+    for filename, result in zip(filenames, results):
+        if result is None:
+            logger.warning('Could not find {}'.format(filename))
+            continue
+
+        bib_entry, title, confidence = result
+        logger.debug('{}: "{}" (confidence {:.2f})'.format(filename, title, confidence))
+        references[bib_entry] = True
+        num_found += 1
+
+    logger.info('Found {} out of {} papers, writing bib file to {}'.format(num_found, len(filenames),
+                                                                         args.out_bib_file))
+    with codecs.open(args.out_bib_file, 'w', 'utf-8') as f_out:
+        for bib_entry in references:
+            f_out.write(bib_entry + '\n\n')
+
+
+def init_worker(acl_anthology_file):
+    """
+    Loads the ACL anthology index in a worker process
+    :param acl_anthology_file: the ACL anthology bib file
+    """
+    global acl_anthology_by_title, title_index
+    _, acl_anthology_by_title = load_acl_anthology(filename=acl_anthology_file, show_progress=False)
+    title_index = load_title_index(acl_anthology_by_title, filename=acl_anthology_file)
+
+
+def resolve_pdf(filename):
+    """
+    Finds the bib entry of a pdf file (in a worker process)
+    :param filename: the pdf file name
+    :return: a tuple of the bib entry, the title and the confidence, or None if not found
+    """
+    return get_from_pdf(filename, acl_anthology_by_title, title_index, min_confidence=args.min_confidence)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+This script runs a local web server with a page of links to bib files, for trying auto_bib.py
+(e.g. its concurrency and rate limiting options) without sending requests to real websites:
+
+    python stub_reference_server.py --num_papers 300 &
+    python auto_bib.py --in_url http://127.0.0.1:8000/
+
+Each bib file is returned after a delay, and the first requests of each bib file fail with 503
+to exercise the retries. It is also used by test_polite_fetcher.py.
+"""
+import re
+import time
+import logging
+import argparse
+import threading
+
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler()])
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+BIB_ENTRY = '@InProceedings{{stub{id},\n  title = "Stub Paper Number {id}",\n  author = "Doe, John",\n  year = "2020"\n}}'
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--port', help='the port to listen on', type=int, default=8000)
+    ap.add_argument('--num_papers', help='the number of links in the page', type=int, default=100)
+    ap.add_argument('--latency', help='the number of seconds before each response', type=float, default=0.1)
+    ap.add_argument('--failures', help='the number of requests of each bib file that fail with 503',
+                    type=int, default=1)
+    args = ap.parse_args()
+
+    server = StubReferenceServer(('127.0.0.1', args.port), num_papers=args.num_papers, latency=args.latency,
+                                 failures=args.failures)
+    logger.info('Listening on http://127.0.0.1:{}/'.format(args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info('Served {} requests ({} failed), at most {} at a time'.format(
+            server.num_requests, server.num_failures, server.max_concurrent))
+
+
+class StubReferenceServer(ThreadingHTTPServer):
+    """
+    Serves the page of links (/) and the bib files (/papers/<id>.bib),
+    and counts the requests, the failed requests and the concurrent requests
+    """
+    daemon_threads = True
+
+    def __init__(self, address, num_papers=100, latency=0.1, failures=1):
+        super().__init__(address, StubRequestHandler)
+        self.num_papers = num_papers
+        self.latency = latency
+        self.failures = failures
+        self.lock = threading.Lock()
+        self.num_requests, self.num_failures, self.concurrent, self.max_concurrent = 0, 0, 0, 0
+        self.requests_per_path = defaultdict(int)
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+
+        with server.lock:
+            server.num_requests += 1
+            server.requests_per_path[self.path] += 1
+            attempt = server.requests_per_path[self.path]
+            server.concurrent += 1
+            server.max_concurrent = max(server.max_concurrent, server.concurrent)
+
+        try:
+            self._handle(attempt)
+        finally:
+            with server.lock:
+                server.concurrent -= 1
+
+    def _handle(self, attempt):
+        if self.path == '/':
+            links = ''.join('<a href="/papers/{}.bib">Paper {}</a>\n'.format(i, i)
+                            for i in range(self.server.num_papers))
+            return self._send('<html><body>\n{}</body></html>'.format(links), 'text/html')
+
+        match = re.match(r'/papers/(\d+)\.bib$', self.path)
+        if not match:
+            return self._send('not found', 'text/plain', status=404)
+
+        time.sleep(self.server.latency)
+
+        if attempt <= self.server.failures:
+            with self.server.lock:
+                self.server.num_failures += 1
+
+            return self._send('try again later', 'text/plain', status=503)
+
+        self._send(BIB_ENTRY.format(id=match.group(1)), 'text/plain')
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send(self, text, content_type, status=200):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+    main()
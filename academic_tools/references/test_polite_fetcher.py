@@ -0,0 +1,75 @@
+"""
+Tests PoliteFetcher and map_concurrently against a local StubReferenceServer
+(run with `python -m pytest` or `python -m unittest` from this directory).
+"""
+import re
+import unittest
+import threading
+import urllib.error
+
+from polite_fetcher import PoliteFetcher, map_concurrently
+from stub_reference_server import StubReferenceServer
+
+
+class PoliteFetcherTest(unittest.TestCase):
+    def start_server(self, num_papers=20, latency=0.02, failures=0):
+        server = StubReferenceServer(('127.0.0.1', 0), num_papers=num_papers, latency=latency, failures=failures)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        base_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        page = PoliteFetcher(delay=0).fetch(base_url + '/').decode('utf-8')
+        links = [base_url + link for link in re.findall('href="([^"]+)"', page)]
+        return server, links
+
+    def test_max_per_host(self):
+        server, links = self.start_server(num_papers=30)
+        fetcher = PoliteFetcher(max_per_host=3, delay=0)
+
+        results = map_concurrently(fetcher.fetch, links, threads=12)
+
+        self.assertTrue(all(result is not None for result in results))
+        self.assertLessEqual(server.max_concurrent, 3)
+
+    def test_retries_within_budget(self):
+        server, links = self.start_server(num_papers=10, failures=1)
+        fetcher = PoliteFetcher(delay=0, retries=2, retry_budget=100, backoff=0.01)
+
+        results = map_concurrently(fetcher.fetch, links, threads=4)
+
+        self.assertTrue(all(result is not None for result in results))
+        self.assertEqual(server.num_failures, 10)
+        self.assertEqual(fetcher.retry_budget, 90)
+
+    def test_retry_budget_exhausted(self):
+        server, links = self.start_server(num_papers=10, failures=1)
+        fetcher = PoliteFetcher(delay=0, retries=2, retry_budget=3, backoff=0.01)
+
+        results = map_concurrently(fetcher.fetch, links, threads=4)
+
+        self.assertEqual(sum(result is not None for result in results), 3)
+        self.assertEqual(fetcher.retry_budget, 0)
+
+    def test_not_found_is_not_retried(self):
+        server, links = self.start_server(num_papers=1)
+        fetcher = PoliteFetcher(delay=0, retries=2, retry_budget=10, backoff=0.01)
+
+        with self.assertRaises(urllib.error.HTTPError):
+            fetcher.fetch(links[0].replace('.bib', '.txt'))
+
+        self.assertEqual(fetcher.retry_budget, 10)
+
+    def test_deterministic_order(self):
+        server, links = self.start_server(num_papers=40, latency=0.01, failures=1)
+
+        for _ in range(2):
+            fetcher = PoliteFetcher(max_per_host=4, delay=0, retries=2, backoff=0.01)
+            results = map_concurrently(fetcher.fetch, links, threads=8)
+            ids = [re.match(r'@InProceedings{stub(\d+),', result.decode('utf-8')).group(1) for result in results]
+            self.assertEqual(ids, [str(i) for i in range(40)])
+
+
+if __name__ == '__main__':
+    unittest.main()
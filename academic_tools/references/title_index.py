@@ -0,0 +1,62 @@
+from array import array
+from collections import defaultdict
+
+
+class TitleIndex:
+    """
+    An approximate-match index of (normalized) paper titles: an inverted list of the titles
+    containing each character n-gram. A query only counts the shared n-grams of the titles in the
+    lists of its rarest n-grams, and then scores these candidates by the Jaccard similarity
+    of their n-gram sets, so it doesn't scan all the titles.
+    """
+    def __init__(self, titles, n=3):
+        """
+        Builds the index.
+        :param titles: an iterable of normalized titles (see common.normalize_title)
+        :param n: the n-gram length
+        """
+        self.n = n
+        self.titles = list(titles)
+        postings = defaultdict(lambda: array('i'))
+
+        for title_id, title in enumerate(self.titles):
+            for gram in self.ngrams(title):
+                postings[gram].append(title_id)
+
+        self.postings = dict(postings)
+
+    def ngrams(self, title):
+        """
+        Returns the set of character n-grams in the title, padded with spaces to mark its beginning and end
+        """
+        title = ' {} '.format(title.strip())
+        return {title[i:i + self.n] for i in range(len(title) - self.n + 1)}
+
+    def search(self, title, num_probes=8, max_candidates=32):
+        """
+        Finds the most similar title in the index
+        :param title: a normalized title
+        :param num_probes: the number of rarest n-grams of the title whose inverted lists are read
+        :param max_candidates: the number of titles sharing the most probed n-grams that are scored
+        :return: a tuple of the best matching title and its similarity (between 0 and 1), or (None, 0.0)
+        """
+        grams = self.ngrams(title)
+        probes = sorted((gram for gram in grams if gram in self.postings), key=lambda gram: len(self.postings[gram]))
+
+        counts = defaultdict(int)
+        for gram in probes[:num_probes]:
+            for title_id in self.postings[gram]:
+                counts[title_id] += 1
+
+        candidates = sorted(counts, key=counts.get, reverse=True)[:max_candidates]
+        best_title, best_score = None, 0.0
+
+        for title_id in candidates:
+            candidate_grams = self.ngrams(self.titles[title_id])
+            shared = len(grams & candidate_grams)
+            score = shared / (len(grams) + len(candidate_grams) - shared)
+
+            if score > best_score:
+                best_title, best_score = self.titles[title_id], score
+
+        return best_title, best_score
@@ -0,0 +1,112 @@
+# Command line arguments
+import argparse
+ap = argparse.ArgumentParser()
+ap.add_argument('corpus', help='The corpus file')
+ap.add_argument('--sample_size', type=int, default=1000, help='The number of paragraphs to compare')
+ap.add_argument('--show_errors', type=int, default=10, help='The number of disagreements to print')
+args = ap.parse_args()
+
+import time
+import codecs
+import random
+import logging
+
+from sentence_tokenizers import load_backend
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    """
+    Compares the spaCy and the rule-based tokenizers on a random sample of paragraphs from the corpus:
+    reports their agreement and their throughput.
+    """
+    paragraphs = sample_paragraphs(args.corpus, args.sample_size)
+    logger.info('Sampled {} paragraphs'.format(len(paragraphs)))
+
+    results = {}
+    for backend in ['spacy', 'fast']:
+        start = time.time()
+        split_sentences = load_backend(backend)
+        load_time = time.time() - start
+
+        start = time.time()
+        results[backend] = [[[t.lower() for t in sent] for sent in split_sentences(paragraph)]
+                            for paragraph in paragraphs]
+        run_time = max(time.time() - start, 1e-9)
+
+        num_tokens = sum(len(sent) for par in results[backend] for sent in par)
+        print('{}: load time {:.2f}s, {:.1f} paragraphs/s, {:.1f} tokens/s'.format(
+            backend, load_time, len(paragraphs) / run_time, num_tokens / run_time))
+
+    report_agreement(paragraphs, results['spacy'], results['fast'])
+
+
+def sample_paragraphs(corpus, sample_size):
+    """
+    Reservoir-sample non-empty paragraphs from the corpus
+    :param corpus: the corpus file
+    :param sample_size: the number of paragraphs to sample
+    :return: a list of paragraphs
+    """
+    sample = []
+    with codecs.open(corpus, 'r', 'utf-8') as f_in:
+        i = 0
+        for paragraph in f_in:
+            paragraph = paragraph.replace('<doc', '').replace('</doc', '').strip()
+            if len(paragraph) == 0:
+                continue
+
+            if len(sample) < sample_size:
+                sample.append(paragraph)
+            else:
+                j = random.randint(0, i)
+                if j < sample_size:
+                    sample[j] = paragraph
+
+            i += 1
+
+    return sample
+
+
+def report_agreement(paragraphs, reference, predicted):
+    """
+    Prints the agreement between two tokenizations of the same paragraphs
+    :param paragraphs: the original paragraphs
+    :param reference: the reference (spaCy) tokenization: a list of sentences for each paragraph
+    :param predicted: the predicted (rule-based) tokenization: a list of sentences for each paragraph
+    """
+    same_tokens = same_sentences = 0
+    ref_sentences = pred_sentences = matching_sentences = 0
+    errors = []
+
+    for paragraph, ref, pred in zip(paragraphs, reference, predicted):
+        ref_tokens = [t for sent in ref for t in sent]
+        pred_tokens = [t for sent in pred for t in sent]
+        same_tokens += ref_tokens == pred_tokens
+        same_sentences += ref == pred
+
+        # Sentence-level precision and recall
+        pred_set = set(tuple(sent) for sent in pred)
+        matching_sentences += sum(1 for sent in ref if tuple(sent) in pred_set)
+        ref_sentences += len(ref)
+        pred_sentences += len(pred)
+
+        if ref != pred:
+            errors.append((paragraph, ref, pred))
+
+    num_paragraphs = max(len(paragraphs), 1)
+    print('Paragraphs with identical tokens: {:.2f}%'.format(100.0 * same_tokens / num_paragraphs))
+    print('Paragraphs with identical tokens and sentences: {:.2f}%'.format(100.0 * same_sentences / num_paragraphs))
+    print('Sentence precision: {:.2f}%, recall: {:.2f}%'.format(100.0 * matching_sentences / max(pred_sentences, 1),
+                                                               100.0 * matching_sentences / max(ref_sentences, 1)))
+
+    for paragraph, ref, pred in errors[:args.show_errors]:
+        print('\nParagraph: {}'.format(paragraph))
+        print('spacy: {}'.format(' | '.join(' '.join(sent) for sent in ref)))
+        print('fast:  {}'.format(' | '.join(' '.join(sent) for sent in pred)))
+
+
+if __name__ == '__main__':
+    main()
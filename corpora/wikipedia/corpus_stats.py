@@ -0,0 +1,77 @@
+import heapq
+import codecs
+import itertools
+
+from collections import Counter
+
+
+class CorpusStatistics:
+    """
+    Word counts and a sentence-length histogram, collected while tokenizing the corpus.
+    Saved as two tab-separated files: <prefix>.vocab (word and count, sorted by word)
+    and <prefix>.lengths (sentence length and count, sorted by length).
+    The vocabulary files are sorted by word so that the statistics of several workers
+    can be merged in a single streaming pass.
+    """
+    def __init__(self):
+        self.word_counts = Counter()
+        self.sentence_lengths = Counter()
+
+    def update(self, tokens):
+        """
+        Adds a tokenized sentence to the statistics
+        :param tokens: the list of tokens in the sentence
+        """
+        self.word_counts.update(tokens)
+        self.sentence_lengths[len(tokens)] += 1
+
+    def save(self, prefix):
+        """
+        Saves the statistics to <prefix>.vocab and <prefix>.lengths
+        :param prefix: the output file name prefix
+        """
+        write_counts(prefix + '.vocab', sorted(self.word_counts.items()))
+        write_counts(prefix + '.lengths', sorted(self.sentence_lengths.items()))
+
+
+def write_counts(filename, items):
+    """
+    Writes (key, count) pairs to a tab-separated file
+    :param filename: the output file
+    :param items: an iterable of (key, count) pairs
+    """
+    with codecs.open(filename, 'w', 'utf-8') as f_out:
+        for key, count in items:
+            f_out.write('{}\t{}\n'.format(key, count))
+
+
+def read_counts(filename):
+    """
+    Reads (key, count) pairs from a tab-separated file
+    :param filename: the input file
+    :return: a generator of (key, count) pairs
+    """
+    with codecs.open(filename, 'r', 'utf-8') as f_in:
+        for line in f_in:
+            key, count = line.rstrip('\n').rsplit('\t', 1)
+            yield key, int(count)
+
+
+def merge_statistics(prefixes, out_prefix, min_count=1):
+    """
+    Merges the statistics files of several workers. The vocabulary files are merged
+    in a single streaming pass, without loading them into memory.
+    :param prefixes: the file name prefixes of the statistics to merge
+    :param out_prefix: the output file name prefix
+    :param min_count: the minimal count of a word to keep it in the merged vocabulary
+    """
+    vocabs = heapq.merge(*[read_counts(prefix + '.vocab') for prefix in prefixes], key=lambda item: item[0])
+    merged = ((word, sum(count for _, count in group))
+              for word, group in itertools.groupby(vocabs, key=lambda item: item[0]))
+    write_counts(out_prefix + '.vocab', ((word, count) for word, count in merged if count >= min_count))
+
+    sentence_lengths = Counter()
+    for prefix in prefixes:
+        sentence_lengths.update({int(length): count for length, count in read_counts(prefix + '.lengths')})
+
+    write_counts(out_prefix + '.lengths', sorted(sentence_lengths.items()))
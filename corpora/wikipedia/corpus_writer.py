@@ -0,0 +1,134 @@
+import os
+import gzip
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+class ShardedCorpusWriter:
+    """
+    A buffered writer for a tokenized corpus (one sentence per line). The output is
+    optionally rotated into fixed-size shards and compressed on the fly with gzip or zstd.
+    When closed, it writes a manifest with the sentence count and byte size of each shard.
+    """
+    def __init__(self, out_prefix, shard_size=0, compression=None, buffer_size=1 << 20):
+        """
+        Initializes the writer.
+        :param out_prefix: the output file name (without shard number and extension)
+        :param shard_size: the maximal number of (uncompressed) bytes in each shard, or 0 for a single file
+        :param compression: None, 'gzip' or 'zstd'
+        :param buffer_size: the number of bytes to accumulate in memory before writing to the disk
+        """
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError('Unknown compression: {}'.format(compression))
+
+        if compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError('zstd compression requires the zstandard package: pip install zstandard')
+
+            self.zstd_compressor = zstandard.ZstdCompressor()
+
+        self.out_prefix = out_prefix
+        self.shard_size = shard_size
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.manifest = []
+        self.raw_file, self.out_file = None, None
+        self.buffer, self.buffered_bytes = [], 0
+        self.shard_sentences, self.shard_bytes = 0, 0
+        self._open_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def shard_name(self, index):
+        """
+        Returns the file name of the index-th shard
+        :param index: the shard number
+        :return: the file name of the shard
+        """
+        extension = COMPRESSION_EXTENSIONS[self.compression]
+
+        if self.shard_size > 0:
+            return '{}_{:05d}{}'.format(self.out_prefix, index, extension)
+
+        return self.out_prefix + extension
+
+    def write(self, sentence):
+        """
+        Writes a single sentence to the current shard, starting a new shard if the current one is full
+        :param sentence: the sentence string (without a line break)
+        """
+        data = (sentence + '\n').encode('utf-8')
+
+        if 0 < self.shard_size < self.shard_bytes + len(data) and self.shard_sentences > 0:
+            self._close_shard()
+            self._open_shard()
+
+        self.buffer.append(data)
+        self.buffered_bytes += len(data)
+        self.shard_bytes += len(data)
+        self.shard_sentences += 1
+
+        if self.buffered_bytes >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered sentences to the current shard
+        """
+        if len(self.buffer) > 0:
+            self.out_file.write(b''.join(self.buffer))
+            self.buffer, self.buffered_bytes = [], 0
+
+    def close(self):
+        """
+        Closes the last shard and writes the manifest
+        """
+        if self.out_file is None:
+            return
+
+        self._close_shard()
+
+        manifest_file = self.out_prefix + '.manifest.json'
+        with open(manifest_file, 'w') as f_out:
+            json.dump({'compression': self.compression, 'shards': self.manifest}, f_out, indent=2)
+
+        logger.info('Wrote {} shards, manifest: {}'.format(len(self.manifest), manifest_file))
+
+    def _open_shard(self):
+        filename = self.shard_name(len(self.manifest))
+        self.raw_file = open(filename, 'wb')
+
+        if self.compression == 'gzip':
+            self.out_file = gzip.GzipFile(filename=os.path.basename(filename), mode='wb', fileobj=self.raw_file)
+        elif self.compression == 'zstd':
+            self.out_file = self.zstd_compressor.stream_writer(self.raw_file)
+        else:
+            self.out_file = self.raw_file
+
+        self.shard_sentences, self.shard_bytes = 0, 0
+
+    def _close_shard(self):
+        self.flush()
+
+        if self.out_file is not self.raw_file:
+            self.out_file.close()
+
+        if not self.raw_file.closed:
+            self.raw_file.close()
+
+        filename = self.shard_name(len(self.manifest))
+        self.manifest.append({'shard': os.path.basename(filename),
+                              'sentences': self.shard_sentences,
+                              'bytes': self.shard_bytes,
+                              'compressed_bytes': os.path.getsize(filename)})
+        self.raw_file, self.out_file = None, None
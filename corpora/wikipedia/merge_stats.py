@@ -0,0 +1,26 @@
+# Command line arguments
+import argparse
+ap = argparse.ArgumentParser()
+ap.add_argument('out_prefix', help='The output file name prefix for the merged statistics')
+ap.add_argument('in_prefixes', nargs='+', help='The file name prefixes of the statistics to merge')
+ap.add_argument('--min_count', type=int, default=1, help='The minimal count of a word in the merged vocabulary')
+args = ap.parse_args()
+
+import logging
+
+from corpus_stats import merge_statistics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    """
+    Merges the vocabulary and sentence-length statistics created by several tokenize_corpus.py workers.
+    """
+    merge_statistics(args.in_prefixes, args.out_prefix, min_count=args.min_count)
+    logger.info('Saved the merged statistics to {}.vocab and {}.lengths'.format(args.out_prefix, args.out_prefix))
+
+
+if __name__ == '__main__':
+    main()
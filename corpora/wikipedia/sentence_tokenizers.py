@@ -0,0 +1,89 @@
+import re
+import unicodedata
+
+BACKENDS = ['spacy', 'fast']
+
+# Sentence-final punctuation (as in spaCy's sentencizer)
+SENTENCE_PUNCT = {'.', '!', '?', '...', '!!', '!!!', '??', '?!', '。', '！', '？'}
+
+# Abbreviations that keep their period (a subset of spaCy's English tokenizer exceptions)
+ABBREVIATIONS = ['mr', 'mrs', 'ms', 'dr', 'prof', 'st', 'jr', 'sr', 'vs', 'etc', 'inc', 'ltd', 'co', 'corp',
+                 'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec',
+                 'mt', 'gen', 'gov', 'rep', 'sen', 'rev', 'messrs', 'ft', 'ph.d']
+
+TOKEN_PATTERN = re.compile(r"""
+      (?:[^\W\d_]\.){2,}                              # acronyms: u.s., e.g.
+    | (?<!\w)(?:%s)\.                               # abbreviations: dr., jan.
+    | (?<!\w)[^\W\d_]\.(?=\s|$)                       # initials: j.
+    | \w+(?=n[’']t\b)                                 # do (n't), ca (n't)
+    | n[’']t\b                                        # n't
+    | [’'](?:s|re|ve|ll|d|m)\b                        # 's, 're, 've, 'll, 'd, 'm
+    | \d+(?:[.,:/]\d+)+                               # numbers: 1,000.5, 10:30, 1/2
+    | \w+                                             # words
+    | \.{2,}                                          # ellipsis
+    | [!?]+                                           # !!!, ?!
+    | \S                                              # any other symbol
+""" % '|'.join(re.escape(a) for a in ABBREVIATIONS), re.VERBOSE | re.IGNORECASE)
+
+
+def tokenize(text):
+    """
+    Splits a text into tokens using regular expressions, approximating spaCy's English tokenizer
+    :param text: the input text
+    :return: a list of tokens
+    """
+    return TOKEN_PATTERN.findall(text)
+
+
+def is_punct(token):
+    """
+    Is this token punctuation (i.e. composed only of punctuation characters)?
+    :param token: the token string
+    :return: whether the token is punctuation
+    """
+    return all(unicodedata.category(c).startswith('P') for c in token)
+
+
+def split_sentences(text):
+    """
+    Tokenizes a text and splits it into sentences. Same rule as spaCy's sentencizer:
+    a new sentence starts at the first non-punctuation token following sentence-final punctuation.
+    :param text: the input text (e.g. a paragraph)
+    :return: a list of sentences, each a list of tokens
+    """
+    sentences, curr = [], []
+    seen_period = False
+
+    for token in tokenize(text):
+        is_sentence_punct = token in SENTENCE_PUNCT
+
+        if seen_period and not is_sentence_punct and not is_punct(token):
+            sentences.append(curr)
+            curr, seen_period = [], False
+        elif is_sentence_punct:
+            seen_period = True
+
+        curr.append(token)
+
+    if len(curr) > 0:
+        sentences.append(curr)
+
+    return sentences
+
+
+def load_backend(backend):
+    """
+    Returns a function that splits a paragraph into tokenized sentences
+    :param backend: 'spacy' (the spaCy English model + sentencizer) or 'fast' (regular expressions)
+    :return: a function from a paragraph string to a list of sentences, each a list of tokens
+    """
+    if backend == 'fast':
+        return split_sentences
+
+    elif backend == 'spacy':
+        import spacy
+        nlp = spacy.load('en', disable=['parser'])
+        nlp.add_pipe(nlp.create_pipe('sentencizer'))
+        return lambda paragraph: [[t.text for t in sent] for sent in nlp(paragraph).sents]
+
+    raise ValueError('Unknown backend: {}'.format(backend))
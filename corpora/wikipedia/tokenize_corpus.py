@@ -2,12 +2,25 @@
 import argparse
 ap = argparse.ArgumentParser()
 ap.add_argument('corpus', help='The corpus file')
+ap.add_argument('--out_prefix', help='The output file name (default: the corpus file name with the suffix _tokenized)')
+ap.add_argument('--shard_size', type=int, default=0,
+                help='The maximal size in bytes of each output shard (default: 0, a single output file)')
+ap.add_argument('--compression', choices=['gzip', 'zstd'], default=None, help='Compress the output on the fly')
+ap.add_argument('--buffer_size', type=int, default=1 << 20,
+                help='The number of bytes to buffer in memory before writing to the disk')
+ap.add_argument('--backend', choices=['spacy', 'fast'], default='spacy',
+                help='The tokenizer: spaCy or a dependency-free rule-based tokenizer (default: spacy)')
+ap.add_argument('--stats', action='store_true',
+                help='Also save the word counts and sentence-length histogram (<out_prefix>.vocab, .lengths)')
 args = ap.parse_args()
 
-import spacy
 import codecs
 import logging
 
+from corpus_stats import CorpusStatistics
+from corpus_writer import ShardedCorpusWriter
+from sentence_tokenizers import load_backend
+
 logger = logging.getLogger(__name__)
 
 
@@ -15,11 +28,14 @@ def main():
     """
     Gets a Wikipedia corpus (converted to text using WikiExtractor) and tokenizes it.
     """
-    nlp = spacy.load('en', disable=['parser'])
-    nlp.add_pipe(nlp.create_pipe('sentencizer'))
+    split_sentences = load_backend(args.backend)
+
+    out_prefix = args.out_prefix or args.corpus + '_tokenized'
+    stats = CorpusStatistics() if args.stats else None
 
     with codecs.open(args.corpus, 'r', 'utf-8') as f_in:
-        with codecs.open(args.corpus + '_tokenized', 'w', 'utf-8', buffering=0) as f_out:
+        with ShardedCorpusWriter(out_prefix, shard_size=args.shard_size, compression=args.compression,
+                                 buffer_size=args.buffer_size) as f_out:
             try:
                 for paragraph in f_in:
 
@@ -28,17 +44,21 @@ def main():
                     if len(paragraph) == 0:
                         continue
 
-                    parsed_par = nlp(paragraph)
-
                     # Tokenize each sentence separately
-                    for sent in parsed_par.sents:
-                        tokens = [t.text.lower() for t in sent]
+                    for sent in split_sentences(paragraph):
+                        tokens = [t.lower() for t in sent]
                         if len(tokens) > 3:
-                            f_out.write(' '.join(tokens) + '\n')
+                            f_out.write(' '.join(tokens))
+
+                            if stats is not None:
+                                stats.update(tokens)
 
             except Exception as err:
                 logger.error(err)
 
+    if stats is not None:
+        stats.save(out_prefix)
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
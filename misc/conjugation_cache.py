@@ -0,0 +1,91 @@
+import json
+import codecs
+
+from collections import OrderedDict
+
+
+class ConjugationCache:
+    """
+    A bounded LRU cache in front of `pattern.en.conjugate`, keyed by (verb, tense, person, number).
+    It can be preloaded from (and saved to) a JSON table of precomputed conjugations,
+    and counts hits and misses to measure the saving.
+    """
+    def __init__(self, conjugate, maxsize=100000, track_new_entries=False):
+        """
+        Initializes the cache.
+        :param conjugate: the conjugation function, called as conjugate(verb, tense=, person=, number=, parse=True)
+        :param maxsize: the maximal number of cached conjugations (0 for unbounded)
+        :param track_new_entries: whether to keep the new conjugations until pop_new_entries is called
+        (e.g. in a worker process that sends them to the main process)
+        """
+        self.conjugate_fn = conjugate
+        self.maxsize = maxsize
+        self.track_new_entries = track_new_entries
+        self.entries = OrderedDict()
+        self.new_entries = []
+        self.hits, self.misses = 0, 0
+
+    def conjugate(self, verb, tense, person, number):
+        """
+        Conjugates the verb, using the cached conjugation if it exists
+        :return: the conjugated verb
+        """
+        key = (verb, tense, person, number)
+
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        result = self.conjugate_fn(verb, tense=tense, person=person, number=number, parse=True)
+        self.add(key, result)
+
+        if self.track_new_entries:
+            self.new_entries.append((key, result))
+        return result
+
+    def add(self, key, result):
+        """
+        Adds a conjugation to the cache, evicting the least recently used one if the cache is full
+        :param key: a (verb, tense, person, number) tuple
+        :param result: the conjugated verb
+        """
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+
+        if 0 < self.maxsize < len(self.entries):
+            self.entries.popitem(last=False)
+
+    def pop_new_entries(self):
+        """
+        Returns the conjugations computed since the last call (e.g. to send them from a worker process),
+        if track_new_entries is set
+        :return: a list of (key, conjugated verb) pairs
+        """
+        new_entries, self.new_entries = self.new_entries, []
+        return new_entries
+
+    def hit_rate(self):
+        """
+        Returns the fraction of lookups answered from the cache
+        :return: the hit rate
+        """
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def load(self, filename):
+        """
+        Preloads the cache from a JSON table of [verb, tense, person, number, conjugated verb] rows
+        :param filename: the table file
+        """
+        with codecs.open(filename, 'r', 'utf-8') as f_in:
+            for verb, tense, person, number, result in json.load(f_in):
+                self.add((verb, tense, person, number), result)
+
+    def save(self, filename):
+        """
+        Saves the cached conjugations as a JSON table of [verb, tense, person, number, conjugated verb] rows
+        :param filename: the table file
+        """
+        with codecs.open(filename, 'w', 'utf-8') as f_out:
+            json.dump([list(key) + [result] for key, result in self.entries.items()], f_out)
@@ -1,11 +1,66 @@
+import os
+import json
+import codecs
+import logging
 import spacy
+import argparse
+import itertools
+import multiprocessing
+
+from collections import deque
 
 from pattern import en
 
+from conjugation_cache import ConjugationCache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 MODALS = {'will', 'shall'}
 
+# Pipeline components that the negation doesn't use
+UNUSED_COMPONENTS = ['ner']
+
+# The spaCy model of each batch-mode worker process
+worker_nlp = None
+
+# Conjugations depend only on (verb, tense, person, number), which repeat heavily across statements
+conjugations = ConjugationCache(en.conjugate)
+
 
 def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--in_file', help='a file with one statement per line (default: interactive mode)')
+    ap.add_argument('--out_file', help='where to save the negated statements, as JSON lines')
+    ap.add_argument('--processes', type=int, default=1, help='the number of worker processes')
+    ap.add_argument('--batch_size', type=int, default=1000, help='the number of statements in each batch')
+    ap.add_argument('--conjugation_cache',
+                    help='a JSON table of precomputed conjugations, loaded at start and updated after a batch run')
+    ap.add_argument('--cache_size', type=int, default=100000, help='the maximal number of cached conjugations')
+    ap.add_argument('--precompute_verbs',
+                    help='a file with one verb form per line: precompute their conjugations into --conjugation_cache')
+    args = ap.parse_args()
+
+    if args.precompute_verbs is not None and args.conjugation_cache is None:
+        ap.error('--precompute_verbs requires --conjugation_cache')
+
+    conjugations.maxsize = args.cache_size
+    if args.conjugation_cache is not None and os.path.exists(args.conjugation_cache):
+        conjugations.load(args.conjugation_cache)
+
+    if args.precompute_verbs is not None:
+        with codecs.open(args.precompute_verbs, 'r', 'utf-8') as f_in:
+            precompute_conjugations([line.strip() for line in f_in if len(line.strip()) > 0])
+
+        conjugations.save(args.conjugation_cache)
+        return
+
+    if args.in_file is not None:
+        out_file = args.out_file or args.in_file + '.negated'
+        negate_file(args.in_file, out_file, processes=args.processes, batch_size=args.batch_size,
+                    conjugation_cache=args.conjugation_cache)
+        return
+
     nlp = spacy.load("en_core_web_sm")
     sentence = input("Enter a sentence, or Q to stop:\n")
 
@@ -27,18 +82,166 @@ def negate_last_verb(nlp, statement):
     :return: the negated statement
     """
     try:
-        doc = [t for t in nlp(statement)]
-        last_verb_index = [i for i, t in enumerate(doc) if t.pos_ == "VERB"][-1]
-        token = doc[last_verb_index]
-        morph_features = nlp.vocab.morphology.tag_map[token.tag_]
-        new_verb = negate(token, morph_features)
-        tokens = [t.text for t in doc]
-        tokens[last_verb_index] = new_verb
-        return " ".join(tokens)
+        negated, _ = negate_last_verb_in_doc(nlp, nlp(statement))
+        return negated
     except:
         return None
 
 
+def negate_last_verb_in_doc(nlp, doc):
+    """
+    Takes a parsed statement and negates it
+    :param nlp: the SpaCy model that parsed the statement
+    :param doc: the SpaCy Doc of the statement
+    :return: a tuple of the negated statement (or None if failed) and the failure reason (or None)
+    """
+    verb_indices = [i for i, t in enumerate(doc) if t.pos_ == "VERB"]
+
+    if len(verb_indices) == 0:
+        return None, "no verb"
+
+    last_verb_index = verb_indices[-1]
+    token = doc[last_verb_index]
+
+    try:
+        morph_features = nlp.vocab.morphology.tag_map[token.tag_]
+        new_verb = negate(token, morph_features)
+    except Exception as err:
+        return None, "error: {}".format(err)
+
+    if new_verb is None:
+        return None, "unsupported verb form: {} ({})".format(token.text, token.tag_)
+
+    tokens = [t.text for t in doc]
+    tokens[last_verb_index] = new_verb
+    return " ".join(tokens), None
+
+
+def negate_file(in_file, out_file, processes=1, batch_size=1000, conjugation_cache=None):
+    """
+    Negates all the statements in a file, in batches, using a pool of worker processes.
+    Each result is written as a JSON line (in the input order) with the keys
+    "statement", "negated" (null if failed) and "error" (the failure reason, or null).
+    :param in_file: a file with one statement per line
+    :param out_file: the output file
+    :param processes: the number of worker processes
+    :param batch_size: the number of statements sent to a worker (and to `nlp.pipe`) at once
+    :param conjugation_cache: optional - a conjugation table to preload in each worker and update at the end
+    """
+    hits, misses = 0, 0
+
+    # Split only on line breaks (codecs.open also splits on e.g. U+2028), so that each result matches an input line
+    with open(in_file, 'r', encoding='utf-8') as f_in, codecs.open(out_file, 'w', 'utf-8') as f_out:
+        statements = (line.rstrip('\r\n') for line in f_in)
+        batches = iter(lambda: list(itertools.islice(statements, batch_size)), [])
+
+        if processes > 1:
+            pool = multiprocessing.Pool(processes, initializer=init_worker,
+                                        initargs=(conjugation_cache, conjugations.maxsize))
+            results = imap_bounded(pool, negate_batch, batches, max_pending=2 * processes)
+        else:
+            init_worker()
+            pool, results = None, map(negate_batch, batches)
+
+        try:
+            for batch_results, batch_hits, batch_misses, new_conjugations in results:
+                for statement, negated, error in batch_results:
+                    f_out.write(json.dumps({"statement": statement, "negated": negated, "error": error}) + '\n')
+
+                hits, misses = hits + batch_hits, misses + batch_misses
+
+                # Collect the conjugations computed by the worker processes
+                if pool is not None:
+                    for key, result in new_conjugations:
+                        conjugations.add(key, result)
+
+        # All the results were consumed (or the writing failed), so the workers can be stopped
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    logger.info('Conjugation cache: {} hits, {} misses, hit rate: {:.2f}%'.format(
+        hits, misses, 100.0 * hits / max(hits + misses, 1)))
+
+    if conjugation_cache is not None:
+        conjugations.save(conjugation_cache)
+
+
+def imap_bounded(pool, function, items, max_pending):
+    """
+    Like pool.imap, but keeps at most `max_pending` items submitted and not yet returned at a time
+    (pool.imap reads the entire input into its task queue at once)
+    :param pool: a multiprocessing pool
+    :param function: the function to apply to each item
+    :param items: an iterable of items
+    :param max_pending: the maximal number of items being processed (or waiting to be returned)
+    :return: a generator of the results, in the order of the items
+    """
+    pending = deque()
+
+    for item in items:
+        pending.append(pool.apply_async(function, (item,)))
+
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+
+    while len(pending) > 0:
+        yield pending.popleft().get()
+
+
+def init_worker(conjugation_cache=None, cache_size=None):
+    """
+    Loads the SpaCy model in a batch-mode worker process, without the unused components
+    :param conjugation_cache: optional - a conjugation table to preload (in worker processes)
+    :param cache_size: optional - the maximal number of cached conjugations (in worker processes)
+    """
+    global worker_nlp
+    worker_nlp = spacy.load("en_core_web_sm", disable=UNUSED_COMPONENTS)
+
+    # Send the new conjugations back with each batch (see negate_batch)
+    conjugations.track_new_entries = True
+
+    if cache_size is not None:
+        conjugations.maxsize = cache_size
+
+    if conjugation_cache is not None and os.path.exists(conjugation_cache):
+        conjugations.load(conjugation_cache)
+
+
+def negate_batch(statements):
+    """
+    Negates a batch of statements with `nlp.pipe`
+    :param statements: a list of statements
+    :return: a list of (statement, negated statement or None, failure reason or None),
+    the number of conjugation cache hits and misses, and the newly computed conjugations
+    """
+    hits, misses = conjugations.hits, conjugations.misses
+    results = []
+    for statement, doc in zip(statements, worker_nlp.pipe(statements)):
+        try:
+            negated, error = negate_last_verb_in_doc(worker_nlp, doc)
+        except Exception as err:
+            negated, error = None, "error: {}".format(err)
+
+        results.append((statement, negated, error))
+
+    return (results, conjugations.hits - hits, conjugations.misses - misses, conjugations.pop_new_entries())
+
+
+def precompute_conjugations(verbs):
+    """
+    Adds the conjugations that `negate` needs for the given verb forms (and for "do") to the cache
+    :param verbs: a list of verb forms, e.g. the most frequent verbs in the corpus
+    """
+    for person, number in itertools.product([1, 2, 3], [en.SG, en.PL]):
+        for tense in [en.PRESENT, en.PAST]:
+            conjugations.conjugate("do", tense, person, number)
+
+        for verb in verbs:
+            conjugations.conjugate(verb, en.INFINITIVE, person, number)
+
+
 def negate(token, morph_features):
     """
     Get a head verb and negate it
@@ -64,17 +267,8 @@ def negate(token, morph_features):
             return " ".join((verb, "not"))
 
         else:
-            aux = en.conjugate("do",
-                               tense=aux_tense,
-                               person=person,
-                               number=number,
-                               parse=True)
-
-            verb = en.conjugate(verb,
-                                tense=en.INFINITIVE,
-                                person=person,
-                                number=number,
-                                parse=True)
+            aux = conjugations.conjugate("do", aux_tense, person, number)
+            verb = conjugations.conjugate(verb, en.INFINITIVE, person, number)
 
             return " ".join((aux, "not", verb))
 
@@ -0,0 +1,253 @@
+"""
+A local HTTP service for statement negation. The spaCy model is loaded once, and concurrent
+requests are collected into micro-batches that are parsed together with `nlp.pipe`.
+
+POST /negate with {"statement": "..."} or {"statements": ["...", ...]}
+returns {"negated": ..., "error": ...} or {"results": [{"negated": ..., "error": ...}, ...]}.
+GET /stats returns latency percentiles, throughput and batching counters.
+"""
+import json
+import time
+import queue
+import spacy
+import logging
+import argparse
+import threading
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from negate_statement import negate_last_verb_in_doc, conjugations, UNUSED_COMPONENTS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--host', default='127.0.0.1', help='the host to listen on')
+    ap.add_argument('--port', type=int, default=8765, help='the port to listen on')
+    ap.add_argument('--max_batch_size', type=int, default=64, help='the maximal number of statements in a batch')
+    ap.add_argument('--max_wait_ms', type=float, default=5.0,
+                    help='the maximal time to wait for more statements before processing a batch')
+    args = ap.parse_args()
+
+    logger.info('Loading the SpaCy model')
+    nlp = spacy.load("en_core_web_sm", disable=UNUSED_COMPONENTS)
+
+    def negate_batch(statements):
+        return [negate_doc(nlp, doc) for doc in nlp.pipe(statements)]
+
+    batcher = MicroBatcher(negate_batch, max_batch_size=args.max_batch_size, max_wait=args.max_wait_ms / 1000.0)
+    batcher.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), NegationRequestHandler)
+    server.batcher = batcher
+    logger.info('Listening on http://{}:{}'.format(args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+
+
+def negate_doc(nlp, doc):
+    """
+    Negates a parsed statement, returning the failure reason instead of raising
+    :return: a tuple of the negated statement (or None if failed) and the failure reason (or None)
+    """
+    try:
+        return negate_last_verb_in_doc(nlp, doc)
+    except Exception as err:
+        return None, "error: {}".format(err)
+
+
+class MicroBatcher:
+    """
+    Collects items submitted concurrently into micro-batches, and processes each batch with
+    a single call in a background thread. A batch is processed when it reaches `max_batch_size`
+    items or `max_wait` seconds after its first item arrived, whichever comes first.
+    """
+    def __init__(self, process_batch, max_batch_size=64, max_wait=0.005, latency_window=10000):
+        """
+        Initializes the batcher.
+        :param process_batch: a function from a list of items to a list of results (in the same order)
+        :param max_batch_size: the maximal number of items in a batch
+        :param max_wait: the maximal number of seconds to wait for more items
+        :param latency_window: the number of recent requests used to compute the latency percentiles
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.latencies = deque(maxlen=latency_window)
+        self.num_items, self.num_batches = 0, 0
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.start_time = time.time()
+        self.thread.start()
+
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    def submit(self, items):
+        """
+        Submits items and waits for their results
+        :param items: a list of items
+        :return: the list of results
+        :raise: the exception raised by `process_batch`, if it failed
+        """
+        pending = [_PendingItem(item) for item in items]
+        for item in pending:
+            self.requests.put(item)
+
+        for item in pending:
+            item.done.wait()
+
+            if item.error is not None:
+                raise item.error
+
+        return [item.result for item in pending]
+
+    def stats(self):
+        """
+        Returns the latency percentiles (in milliseconds), throughput and batching counters
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            num_items, num_batches = self.num_items, self.num_batches
+
+        percentile = lambda p: 1000.0 * latencies[min(int(p * len(latencies)), len(latencies) - 1)] \
+            if len(latencies) > 0 else None
+
+        return {'items': num_items,
+                'batches': num_batches,
+                'mean_batch_size': num_items / max(num_batches, 1),
+                'items_per_second': num_items / max(time.time() - self.start_time, 1e-9),
+                'p50_latency_ms': percentile(0.5),
+                'p99_latency_ms': percentile(0.99)}
+
+    def _run(self):
+        while True:
+            first = self.requests.get()
+            if first is None:
+                return
+
+            batch = [first]
+            deadline = time.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.time()
+                try:
+                    item = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+                except queue.Empty:
+                    break
+
+                if item is None:
+                    self.requests.put(None)
+                    break
+
+                batch.append(item)
+
+            results, errors = self._process(batch)
+
+            end_time = time.time()
+            with self.lock:
+                self.num_items += len(batch)
+                self.num_batches += 1
+                self.latencies.extend(end_time - item.submit_time for item in batch)
+
+            for item, result, error in zip(batch, results, errors):
+                item.result, item.error = result, error
+                item.done.set()
+
+    def _process(self, batch):
+        """
+        Processes a batch. If it fails, processes its items one at a time, so that
+        a bad item only fails its own request and not the other requests in the batch.
+        :return: the list of results and the list of errors (None for the successful items)
+        """
+        try:
+            return self.process_batch([item.item for item in batch]), [None] * len(batch)
+        except Exception as err:
+            if len(batch) == 1:
+                logger.error(err)
+                return [None], [err]
+
+        results, errors = [], []
+        for item in batch:
+            (result,), (error,) = self._process([item])
+            results.append(result)
+            errors.append(error)
+
+        return results, errors
+
+
+class _PendingItem:
+    def __init__(self, item):
+        self.item = item
+        self.result, self.error = None, None
+        self.submit_time = time.time()
+        self.done = threading.Event()
+
+
+class NegationRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the /negate and /stats requests
+    """
+    def do_POST(self):
+        if self.path != '/negate':
+            return self._send_json({'error': 'not found'}, status=404)
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        except ValueError:
+            return self._send_json({'error': 'invalid JSON'}, status=400)
+
+        if not isinstance(request, dict):
+            return self._send_json({'error': 'the request should be a JSON object'}, status=400)
+
+        statements = request['statements'] if 'statements' in request else [request.get('statement', '')]
+        if not isinstance(statements, list) or not all(isinstance(statement, str) for statement in statements):
+            return self._send_json({'error': 'the statements should be strings'}, status=400)
+
+        try:
+            results = [{'negated': negated, 'error': error}
+                       for negated, error in self.server.batcher.submit(statements)]
+        except Exception as err:
+            return self._send_json({'error': str(err)}, status=500)
+
+        if 'statements' in request:
+            self._send_json({'results': results})
+        else:
+            self._send_json(results[0])
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self._send_json({'error': 'not found'}, status=404)
+
+        stats = self.server.batcher.stats()
+        stats['conjugation_cache_hit_rate'] = conjugations.hit_rate()
+        self._send_json(stats)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+    main()